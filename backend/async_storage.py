@@ -0,0 +1,94 @@
+import os
+import asyncio
+import functools
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from deadlines import remaining, DeadlineExceeded
+
+# Dedicated, bounded pool for blocking boto3 calls:
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "16"))
+# How often (seconds) the event loop lag probe wakes up:
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_POOL_SIZE, thread_name_prefix="storage")
+
+
+# Run a blocking storage helper off the event loop:
+async def run_storage(func, *args, **kwargs):
+    """
+    Await a blocking storage function (anything in aws_s3 / email_utils that
+    talks to S3) on the dedicated storage pool.
+
+    The caller's context variables are copied into the worker thread, and
+    the caller stops waiting once its request deadline passes (the S3
+    client's own connect/read timeouts bound the thread itself).
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(
+        storage_executor,
+        functools.partial(context.run, func, *args, **kwargs)
+    )
+    if left is None:
+        return await future
+    try:
+        return await asyncio.wait_for(future, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline exceeded in {getattr(func, '__name__', func)}")
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how late a sleep of `interval` seconds wakes up.
+
+    Anything blocking the loop shows up directly as lag, so this is the
+    number to watch when checking that no endpoint calls S3 inline.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = 240):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "samples": len(samples),
+            "last_ms": round(self.samples[-1] * 1000, 2),
+            "p50_ms": round(percentile(0.50) * 1000, 2),
+            "p99_ms": round(percentile(0.99) * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
+
+LOOP_LAG = LoopLagMonitor()
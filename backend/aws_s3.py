@@ -2,25 +2,109 @@ import boto3
 import os
 from datetime import datetime
 import json
-import csv
-import io
 import hashlib
-import requests
-import base64
+import botocore
+import botocore.config
 
-# Use the S3 client:
+from async_storage import STORAGE_POOL_SIZE
+from deadlines import S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT
+from log_store import SegmentLog, LogIndex
+from team_names import TeamNameIndex
+from s3_writes import update_object, put_if_absent
+from prompt_log import PromptLogBuffer
+
+# Use the S3 client (one pooled connection per storage worker thread, bounded timeouts):
 s3 = boto3.client(
-    "s3"
+    "s3",
+    config=botocore.config.Config(
+        max_pool_connections=STORAGE_POOL_SIZE,
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={"max_attempts": 3, "mode": "standard"}
+    )
 )
 
 AWS_BUCKET = "tribelet-resources"
 
+# Append-only logs (one small segment object per write):
+USER_LOG = SegmentLog(
+    s3, AWS_BUCKET, "users/log",
+    columns=["timestamp", "username", "email", "password_hash"],
+    legacy_key="users/user_log.csv"
+)
+
+TEAM_LOG = SegmentLog(
+    s3, AWS_BUCKET, "teams/log",
+    columns=["timestamp", "team_name", "summary", "logo_url", "email", "team_id", "team_lead", "logo_variants"],
+    legacy_key="teams/team_log.csv"
+)
+
+# How stale (seconds) the in-memory indexes may get before re-checking S3:
+USER_INDEX_MAX_STALENESS = float(os.getenv("USER_INDEX_MAX_STALENESS", "30"))
+# Minimum gap (seconds) between forced refreshes triggered by failed lookups:
+USER_INDEX_MISS_REFRESH = float(os.getenv("USER_INDEX_MISS_REFRESH", "2"))
+
 # --- Users ---
 
 # Password encoding:
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+# In-memory user index (email -> user records):
+class UserIndex(LogIndex):
+    """
+    Per-worker email -> user records index over USER_LOG.
+
+    Lookups are dictionary hits. A lookup that finds nothing refreshes early
+    (rate-limited by USER_INDEX_MISS_REFRESH) so an account created on another
+    worker can log in straight away.
+    """
+
+    def __init__(self, log, max_staleness=USER_INDEX_MAX_STALENESS, miss_refresh=USER_INDEX_MISS_REFRESH):
+        super().__init__(log, max_staleness)
+        self.miss_refresh = miss_refresh
+        self.users = {}
+
+    def reset(self):
+        with self._lock:
+            self.users = {}
+
+    def add_rows(self, rows):
+        with self._lock:
+            for row in rows:
+                records = self.users.setdefault(row.get("email", ""), [])
+                if row not in records:
+                    records.append(row)
+
+    def _match(self, email: str, password_hash: str) -> dict | None:
+        # Under the lock, so a full reload is never seen half done:
+        with self._lock:
+            for row in self.users.get(email, []):
+                if row.get("password_hash") == password_hash:
+                    return row
+        return None
+
+    def find(self, email: str, password: str) -> dict | None:
+        hashed = hash_password(password)
+        self.refresh()
+        row = self._match(email, hashed)
+        if row is None and self.age >= self.miss_refresh:
+            self.refresh(force=True)
+            row = self._match(email, hashed)
+
+        with self._lock:
+            self.stats["hits" if row else "misses"] += 1
+        return row
+
+USER_INDEX = UserIndex(USER_LOG)
+
+# Prompt log (buffered, flushed as NDJSON segments):
+PROMPT_LOG_PREFIX = "prompts/segments/"
+PROMPT_LOG = PromptLogBuffer(s3, AWS_BUCKET, PROMPT_LOG_PREFIX)
+
+# In-memory team name index, backed by a Bloom filter snapshot in S3:
+TEAM_NAME_INDEX = TeamNameIndex(TEAM_LOG, s3, AWS_BUCKET, "teams/name_bloom.bin")
+
 # Save the user:
 def save_user_to_s3(user_data):
     row = [
@@ -30,108 +114,42 @@ def save_user_to_s3(user_data):
         hash_password(user_data.get("password", ""))
     ]
 
-    try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="users/user_log.csv")
-        existing_csv = response['Body'].read().decode('utf-8')
-    except s3.exceptions.NoSuchKey:
-        existing_csv = ""
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    if not existing_csv:
-        writer.writerow(["timestamp",
-                         "username",
-                         "email",
-                         "password_hash"])
-    else:
-        output.write(existing_csv.strip() + "\n")
-    
-    writer.writerow(row)
+    USER_LOG.append(row)
 
-    s3.put_object(
-        Bucket=AWS_BUCKET,
-        Key="users/user_log.csv",
-        Body=output.getvalue(),
-        ContentType="text/csv"
-    )
+    # Make the new account visible to this worker immediately:
+    USER_INDEX.add_rows([dict(zip(USER_LOG.columns, row))])
 
 # validate our user login:
 def validate_user_login(email: str, password: str) -> str | None:
-    try:
-        response = s3.get_object(Bucket=AWS_BUCKET,
-                                 Key="users/user_log.csv")
-        csv_text = response['Body'].read().decode('utf-8')
-        reader = csv.DictReader(io.StringIO(csv_text))
-        hashed = hash_password(password)
-
-        for row in reader:
-            if row['email'] == email and row['password_hash'] == hashed:
-                return row["username"]
-    except s3.exceptions.NoSuchKey:
-        pass
-    
-    return None
+    row = USER_INDEX.find(email, password)
+    return row["username"] if row else None
 
 # Get user by credentials (used in team creation process):
 def get_user_by_credentials(email: str, password: str) -> dict | None:
-    try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="users/user_log.csv")
-        csv_text = response['Body'].read().decode('utf-8')
-        reader = csv.DictReader(io.StringIO(csv_text))
-        hashed = hash_password(password)
-
-        for row in reader:
-            if row['email'] == email and row['password_hash'] == hashed:
-                return row
-    except s3.exceptions.NoSuchKey:
-        pass
-
-    return None
+    return USER_INDEX.find(email, password)
 
 
 # --- Teams ---
 
 # Save our promts to S3:
 def save_prompt_to_s3(prompt: str):
-    try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="prompt_log.json")
-        body = response['Body'].read().decode('utf-8')
-        logs = json.loads(body)
-    except s3.exceptions.NoSuchKey:
-        logs = []
-
-    logs.append({
+    # Buffered in memory; PROMPT_LOG writes it to S3 in the background.
+    PROMPT_LOG.add({
         "timestamp": datetime.utcnow().isoformat(),
         "prompt": prompt
     })
 
-    s3.put_object(
-        Bucket=AWS_BUCKET,
-        Key="prompt_log.json",
-        Body=json.dumps(logs, indent=2),
-        ContentType="application/json"
-    )
-
 # Check team names:
 def check_team_name_in_s3(name):
     try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="teams/team_log.csv")
-        csv_text = response["Body"].read().decode("utf-8")
-        reader = csv.DictReader(io.StringIO(csv_text))
-        for row in reader:
-            if row.get("team_name", "").strip().lower() == name.strip().lower():
-                return True
-        return False
-    except s3.exceptions.NoSuchKey:
-        return False
+        return TEAM_NAME_INDEX.exists(name)
     except botocore.exceptions.ClientError as error:
         # Log this error and return a safe JSON response for browser:
         print(f"S3 ClientError: {error}")
         return False
     except Exception as e:
         # Log unexpected errors:
-        print("Unexpected error: {e}")
+        print(f"Unexpected error: {e}")
         return False
 
 # Save the team to S3:
@@ -143,89 +161,138 @@ def save_team_to_s3(team_data):
         team_data.get("logo_url", ""),
         team_data.get("email", ""),
         team_data.get("team_id", ""),
-        team_data.get("team_lead", "")
+        team_data.get("team_lead", ""),
+        json.dumps(team_data.get("logo_variants", {}))
     ]
 
+    TEAM_LOG.append(row)
+    TEAM_NAME_INDEX.add(team_data.get("team_name", ""))
+    add_team_to_email_index(_team_record(dict(zip(TEAM_LOG.columns, row))))
+
+# Team log rows keep logo variant URLs as JSON text; API records use a dict:
+def _team_record(row: dict) -> dict:
+    variants = row.get("logo_variants")
+    if isinstance(variants, str):
+        try:
+            variants = json.loads(variants) if variants else {}
+        except ValueError:
+            variants = {}
+    return dict(row, logo_variants=variants or {})
+
+# --- Per-email team index ---
+
+TEAM_EMAIL_INDEX_PREFIX = "teams/by_email/"
+TEAM_EMAIL_INDEX_MARKER = f"{TEAM_EMAIL_INDEX_PREFIX}_built.json"
+
+# Set once the backfill marker has been seen, so we stop checking for it:
+_team_email_index_built = False
+
+def team_email_index_key(email: str) -> str:
+    return f"{TEAM_EMAIL_INDEX_PREFIX}{hashlib.sha256(email.encode()).hexdigest()}.json"
+
+def _read_team_email_index(email: str) -> list[dict]:
     try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="teams/team_log.csv")
-        existing_csv = response["Body"].read().decode("utf-8")
+        response = s3.get_object(Bucket=AWS_BUCKET, Key=team_email_index_key(email))
+        return json.loads(response["Body"].read().decode("utf-8"))["teams"]
     except s3.exceptions.NoSuchKey:
-        existing_csv = ""
+        return []
 
-    output = io.StringIO()
-    writer = csv.writer(output)
+# Merge teams into an email's index object (conditional read-modify-write):
+def _update_team_email_index(email: str, teams: list[dict]):
+    def merge(current):
+        existing = json.loads(current)["teams"] if current else []
+        return json.dumps({"email": email, "teams": _merge_teams(existing, teams)})
 
-    if not existing_csv:
-        writer.writerow(["timestamp", "team_name", "summary", "logo_url", "email", "team_id", "team_lead"])
-    else:
-        output.write(existing_csv.strip() + "\n")
+    update_object(s3, AWS_BUCKET, team_email_index_key(email), merge, ContentType="application/json")
 
-    writer.writerow(row)
+def _merge_teams(existing: list[dict], new: list[dict]) -> list[dict]:
+    # Keep one record per team_id, in creation order:
+    merged = {team.get("team_id") or team.get("timestamp"): team for team in existing}
+    for team in new:
+        merged.setdefault(team.get("team_id") or team.get("timestamp"), team)
+    return sorted(merged.values(), key=lambda team: team.get("timestamp", ""))
 
-    s3.put_object(
-        Bucket=AWS_BUCKET,
-        Key="teams/team_log.csv",
-        Body=output.getvalue(),
-        ContentType="text/csv"
-    )
+# Add a team to its owner's index object:
+def add_team_to_email_index(team: dict):
+    _update_team_email_index(team.get("email", ""), [team])
+
+def _team_email_index_is_built() -> bool:
+    global _team_email_index_built
+    if not _team_email_index_built:
+        # Only a missing marker means "not built"; other errors propagate:
+        _team_email_index_built = object_exists(TEAM_EMAIL_INDEX_MARKER)
+    return _team_email_index_built
 
-# Save the team logo locally in AWS blob:
-def upload_logo_from_url(external_url: str, team_id: str) -> str:
-    response = requests.get(external_url)
-    if response.status_code != 200:
-        raise Exception("Failed to download logo image from OpenAI URL")
+# Backfill the per-email index from the full team log:
+def rebuild_team_email_index() -> int:
+    """
+    Rebuild every per-email index object from TEAM_LOG.
+
+    Entries are merged into existing objects with conditional writes, so
+    teams saved while the rebuild runs are kept.
+
+    Returns:
+        int: Number of email addresses indexed
+    """
+    by_email = {}
+    for row in TEAM_LOG.read_rows():
+        by_email.setdefault(row.get("email", ""), []).append(_team_record(row))
+
+    for email, teams in by_email.items():
+        _update_team_email_index(email, teams)
 
-    key = f"logos/{team_id}.png"
     s3.put_object(
         Bucket=AWS_BUCKET,
-        Key=key,
-        Body=response.content,
-        ContentType="image/png"
+        Key=TEAM_EMAIL_INDEX_MARKER,
+        Body=json.dumps({"built_at": datetime.utcnow().isoformat(), "emails": len(by_email)}),
+        ContentType="application/json"
     )
-    return f"https://{AWS_BUCKET}.s3.amazonaws.com/{key}"
+    return len(by_email)
 
+# --- Logos ---
 
-# Retrieve existing teams from aws:
-def get_teams_by_email(email: str) -> list[dict]:
+# Logos are content-addressed, so an object never changes once written:
+LOGO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def logo_key_for_digest(digest: str) -> str:
+    return f"logos/sha256/{digest}.png"
+
+def logo_key_for(image_data: bytes) -> str:
+    return logo_key_for_digest(hashlib.sha256(image_data).hexdigest())
+
+def public_url(key: str) -> str:
+    return f"https://{AWS_BUCKET}.s3.amazonaws.com/{key}"
+
+def object_exists(key: str) -> bool:
     try:
-        response = s3.get_object(Bucket=AWS_BUCKET, Key="teams/team_log.csv")
-        csv_text = response["Body"].read().decode("utf-8")
-        reader = csv.DictReader(io.StringIO(csv_text))
-        return [row for row in reader if row.get("email") == email]
-    except s3.exceptions.NoSuchKey:
-        return []
-    
+        s3.head_object(Bucket=AWS_BUCKET, Key=key)
+        return True
+    except botocore.exceptions.ClientError as error:
+        if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
 
-# Logo upload from base64:
-def upload_logo_from_base64(base64_data: str, team_id: str) -> str:
+# Store logo bytes once, keyed by their hash:
+def store_logo_bytes(image_data: bytes) -> str:
     """
-    Upload a base64-encoded logo directly to S3.
-    
-    Args:
-        base64_data (str): Base64 encoded image data
-        team_id (str): Unique team ID for the filename
-    
+    Upload a PNG under its SHA-256 key unless identical bytes are already stored.
+
     Returns:
-        str: Public S3 URL of the uploaded logo
+        str: Public S3 URL of the (possibly shared) logo object
     """
-    try:
-        # Decode base64 data
-        image_data = base64.b64decode(base64_data)
-        
-        # Generate S3 key
-        key = f"logos/{team_id}.png"
-        
-        # Upload to S3
-        s3.put_object(
-            Bucket=AWS_BUCKET,
-            Key=key,
-            Body=image_data,
-            ContentType="image/png"
+    key = logo_key_for(image_data)
+    if not object_exists(key):
+        put_if_absent(
+            s3, AWS_BUCKET, key, image_data,
+            ContentType="image/png",
+            CacheControl=LOGO_CACHE_CONTROL
         )
-        
-        # Return public URL
-        return f"https://{AWS_BUCKET}.s3.amazonaws.com/{key}"
-        
-    except Exception as e:
-        print(f"Base64 logo upload failed: {e}")
-        raise Exception(f"Failed to upload logo: {str(e)}")
\ No newline at end of file
+    return public_url(key)
+
+# Retrieve existing teams from aws:
+def get_teams_by_email(email: str) -> list[dict]:
+    if _team_email_index_is_built():
+        return _read_team_email_index(email)
+
+    # Index not backfilled yet (run `python manage.py rebuild-team-email-index`):
+    return [_team_record(row) for row in TEAM_LOG.read_rows() if row.get("email") == email]
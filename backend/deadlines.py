@@ -0,0 +1,61 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+# Default budget (seconds) for one API request, and longer ones by path prefix:
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+REQUEST_DEADLINES = {
+    "/api/generate-logo": float(os.getenv("LOGO_REQUEST_DEADLINE", "300")),
+    "/api/generate-all": float(os.getenv("LOGO_REQUEST_DEADLINE", "300")),
+    "/api/send-order-confirmation": float(os.getenv("ORDER_REQUEST_DEADLINE", "60")),
+}
+
+# Upper bounds per upstream call, used as-is outside a request:
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_IMAGE_TIMEOUT = float(os.getenv("OPENAI_IMAGE_TIMEOUT", "240"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "20"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Absolute time.monotonic() by which the current request must finish:
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def deadline_for_path(path: str) -> float:
+    for prefix, seconds in REQUEST_DEADLINES.items():
+        if path.startswith(prefix):
+            return seconds
+    return REQUEST_DEADLINE
+
+@contextmanager
+def deadline(seconds: float):
+    """Run the block with a budget of `seconds` (never extending an outer, earlier deadline)."""
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> float | None:
+    """Seconds left in the current budget, or None when there is no deadline."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+def call_timeout(cap: float) -> float:
+    """
+    Timeout for the next upstream call: the remaining budget, at most `cap`.
+    Raises DeadlineExceeded if the budget is already spent.
+    """
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(cap, left)
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import uuid
+import email
+import random
+import atexit
+import threading
+from datetime import datetime
+
+from s3_writes import put_if_absent, update_object
+from s3_objects import time_key, list_keys
+from smtp_pool import get_smtp_pool, PERMANENT_ERRORS
+from deadlines import SMTP_TIMEOUT
+
+# Queued messages (keyed by due time, then ID), and those that ran out of attempts:
+OUTBOX_PENDING_PREFIX = "outbox/pending/"
+OUTBOX_DEAD_PREFIX = "outbox/dead/"
+# How often (seconds) the worker looks for due messages when not woken sooner:
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Retry delay: full jitter over base * 2^attempts, capped (seconds):
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "30"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+# A worker owns a claimed message for this long (seconds) before others may retry it.
+# It must outlast a whole batch: every send (plus a reconnect) can take SMTP_TIMEOUT.
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", str(60 + (OUTBOX_BATCH_SIZE + 8) * SMTP_TIMEOUT)))
+
+
+def _summary(record: dict) -> dict:
+    message = email.message_from_string(record["message"])
+    return {
+        "id": record["id"],
+        "order_id": record.get("order_id"),
+        "to": message["To"],
+        "subject": str(message["Subject"]),
+        "created_at": record["created_at"],
+        "attempts": record["attempts"],
+        "next_attempt_at": record["next_attempt_at"],
+        "last_error": record.get("last_error"),
+    }
+
+
+class EmailOutbox:
+    """
+    Durable outbox for outgoing mail.
+
+    `enqueue` writes each rendered message to S3 under the pending prefix and
+    returns. Pending keys start with the message's due time, so a poll finds
+    due work from the listing alone. A background thread claims due messages
+    with a lease (so several API workers can run it without double-sending),
+    delivers them through the SMTP pool, deletes them on success, and on
+    failure re-files them under a later due time (jittered exponential
+    backoff). Messages that fail
+    OUTBOX_MAX_ATTEMPTS times, or are refused outright, move to the dead
+    prefix until replayed.
+    """
+
+    def __init__(self, client, bucket: str, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.client = client
+        self.bucket = bucket
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"enqueued": 0, "sent": 0, "retried": 0, "dead_lettered": 0, "replayed": 0}
+
+    # --- Records ---
+
+    def _dead_key(self, record_id: str) -> str:
+        return f"{OUTBOX_DEAD_PREFIX}{record_id}.json"
+
+    def _pending_key(self, record: dict) -> str:
+        due = datetime.utcfromtimestamp(record["next_attempt_at"])
+        return f"{OUTBOX_PENDING_PREFIX}{time_key(due)}_{record['id']}.json"
+
+    @staticmethod
+    def _parse_pending_key(key: str) -> tuple[str, str]:
+        """(due time stamp, record ID)"""
+        due, record_id = key[len(OUTBOX_PENDING_PREFIX):-len(".json")].split("_", 1)
+        return due, record_id
+
+    def _find_pending(self, record_id: str) -> str | None:
+        for key in self._list(OUTBOX_PENDING_PREFIX):
+            if self._parse_pending_key(key)[1] == record_id:
+                return key
+        return None
+
+    def _read(self, key: str) -> dict | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read().decode("utf-8"))
+
+    def _list(self, prefix: str) -> list[str]:
+        return list_keys(self.client, self.bucket, prefix)
+
+    def _update(self, key: str, change) -> dict | None:
+        """Apply `change(record) -> bool` to a pending record; writes only if it returns True."""
+        def mutate(current):
+            if current is None:
+                return None
+            record = json.loads(current)
+            if not change(record):
+                return None
+            return json.dumps(record).encode("utf-8")
+
+        body = update_object(self.client, self.bucket, key, mutate, ContentType="application/json")
+        return json.loads(body) if body is not None else None
+
+    def _reschedule(self, key: str, record: dict, **changes):
+        """Re-file a claimed pending record under its new due time."""
+        record = dict(record, lease_until=0, **changes)
+        # Write the new key before deleting the old: a crash in between can
+        # resend the message, but never lose it.
+        put_if_absent(
+            self.client, self.bucket, self._pending_key(record),
+            json.dumps(record).encode("utf-8"), ContentType="application/json"
+        )
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    # --- Enqueue ---
+
+    def enqueue(self, messages: list, order_id: str | None = None) -> list[str]:
+        """
+        Persist rendered messages for background delivery.
+
+        Returns:
+            list: The outbox IDs, in send order
+        """
+        now = time.time()
+        ids = []
+        for position, message in enumerate(messages):
+            # Time-ordered IDs, so listing the prefix gives FIFO order:
+            record_id = f"{time_key()}-{position}-{uuid.uuid4().hex[:12]}"
+            record = {
+                "id": record_id,
+                "order_id": order_id,
+                "message": message.as_string(),
+                "created_at": now,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "lease_until": 0,
+                "last_error": None,
+            }
+            put_if_absent(
+                self.client, self.bucket, self._pending_key(record),
+                json.dumps(record).encode("utf-8"), ContentType="application/json"
+            )
+            ids.append(record_id)
+
+        self.stats["enqueued"] += len(ids)
+        self._wake.set()
+        return ids
+
+    # --- Delivery ---
+
+    def _claim(self, key: str) -> dict | None:
+        now = time.time()
+
+        def change(record):
+            if record["next_attempt_at"] > now or record["lease_until"] > now:
+                return False
+            record["lease_until"] = now + OUTBOX_LEASE
+            return True
+
+        return self._update(key, change)
+
+    def _retry_delay(self, attempts: int) -> float:
+        return random.uniform(0, min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * (2 ** attempts)))
+
+    def _failed(self, key: str, record: dict, error: Exception):
+        attempts = record["attempts"] + 1
+        if attempts >= self.max_attempts or isinstance(error, PERMANENT_ERRORS):
+            record = dict(record, attempts=attempts, last_error=str(error), lease_until=0)
+            put_if_absent(
+                self.client, self.bucket, self._dead_key(record["id"]),
+                json.dumps(record).encode("utf-8"), ContentType="application/json"
+            )
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+            self.stats["dead_lettered"] += 1
+            print(f"Outbox message {record['id']} dead-lettered after {attempts} attempts: {error}")
+            return
+
+        delay = self._retry_delay(attempts)
+        self._reschedule(key, record, attempts=attempts, last_error=str(error), next_attempt_at=time.time() + delay)
+        self.stats["retried"] += 1
+        print(f"Outbox message {record['id']} failed ({error}), retrying in {delay:.0f}s")
+
+    def deliver_due(self) -> int:
+        """
+        Send every pending message that is due (up to the batch size) through
+        the SMTP pool, which reconnects once if the session drops.
+
+        Returns:
+            int: Number of messages sent
+        """
+        now = time_key()
+        claimed = []
+        for key in self._list(OUTBOX_PENDING_PREFIX):
+            if len(claimed) >= self.batch_size:
+                break
+            # Keys sort by due time, so nothing past the first future one is due:
+            if self._parse_pending_key(key)[0] > now:
+                break
+            record = self._claim(key)
+            if record is not None:
+                claimed.append((key, record))
+        if not claimed:
+            return 0
+
+        results = {}
+
+        def on_result(index, error):
+            # Called as each message is accepted or refused, so a session that
+            # drops later doesn't put already-sent messages back in the queue.
+            key, record = claimed[index]
+            results[index] = error
+            try:
+                if error is None:
+                    self.client.delete_object(Bucket=self.bucket, Key=key)
+                    self.stats["sent"] += 1
+                else:
+                    self._failed(key, record, error)
+            except Exception as e:
+                print(f"Outbox bookkeeping for {record['id']} failed: {e}")
+
+        try:
+            get_smtp_pool().send_messages(
+                [email.message_from_string(record["message"]) for _, record in claimed], on_result=on_result
+            )
+        except Exception as e:
+            # The pool already retried on a fresh session: the rest go back for a retry.
+            for index, (key, record) in enumerate(claimed):
+                if index not in results:
+                    self._failed(key, record, e)
+        return sum(1 for error in results.values() if error is None)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                # Keep going while full batches are coming back:
+                while self.deliver_due() >= self.batch_size and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                print(f"Outbox delivery failed: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the delivery thread (undelivered messages stay in the outbox)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval)
+
+    # --- Admin ---
+
+    def list_messages(self, state: str = "pending") -> list[dict]:
+        prefix = OUTBOX_DEAD_PREFIX if state == "dead" else OUTBOX_PENDING_PREFIX
+        records = (self._read(key) for key in self._list(prefix))
+        return [_summary(record) for record in records if record is not None]
+
+    def replay(self, record_id: str) -> bool:
+        """
+        Send a message again as soon as possible: dead messages go back to
+        pending with a fresh attempt count; pending ones are made due now.
+
+        Returns:
+            bool: False if no such message exists
+        """
+        if not record_id.replace("-", "").isalnum():
+            return False
+        dead_key = self._dead_key(record_id)
+        record = self._read(dead_key)
+        if record is not None:
+            record.update(attempts=0, next_attempt_at=time.time(), lease_until=0)
+            put_if_absent(
+                self.client, self.bucket, self._pending_key(record),
+                json.dumps(record).encode("utf-8"), ContentType="application/json"
+            )
+            self.client.delete_object(Bucket=self.bucket, Key=dead_key)
+        else:
+            key = self._find_pending(record_id)
+            if key is None:
+                return False
+            now = time.time()
+
+            def change(current):
+                # Claim it first, so no worker sends it while it moves:
+                if current["lease_until"] > now:
+                    return False
+                current["lease_until"] = now + OUTBOX_LEASE
+                return True
+
+            claimed = self._update(key, change)
+            if claimed is not None:
+                self._reschedule(key, claimed, next_attempt_at=now)
+            # Otherwise it is being sent right now.
+
+        self.stats["replayed"] += 1
+        self._wake.set()
+        return True
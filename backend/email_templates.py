@@ -0,0 +1,244 @@
+import os
+import html
+import uuid
+import string
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+# Email bodies live here as <name>.txt / <name>.html, with $placeholders:
+EMAIL_TEMPLATE_DIR = os.getenv(
+    "EMAIL_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+)
+# Who gets the "new order to process" alert:
+ORDER_PROCESSING_EMAIL = os.getenv("ORDER_PROCESSING_EMAIL", "cam@tribeletco.com")
+
+
+class Safe(str):
+    """Markup that is already escaped; HTML templates insert it as-is."""
+
+
+class CompiledTemplate:
+    """
+    A `string.Template`-syntax template split once into literal text and
+    fields, so rendering is one pass of lookups and a join. HTML templates
+    escape every value that isn't `Safe`.
+    """
+
+    def __init__(self, name: str, source: str, autoescape: bool = False):
+        self.name = name
+        self.autoescape = autoescape
+        self._parts = []
+        self._fields = []
+
+        position = 0
+        for match in string.Template.pattern.finditer(source):
+            self._parts.append(source[position:match.start()])
+            if match.group("escaped") is not None:
+                self._parts.append("$")
+            elif match.group("invalid") is not None:
+                line = source.count("\n", 0, match.start()) + 1
+                raise ValueError(f"Invalid placeholder in template {name} (line {line})")
+            else:
+                self._fields.append((len(self._parts), match.group("named") or match.group("braced")))
+                self._parts.append(None)
+            position = match.end()
+        self._parts.append(source[position:])
+
+    @property
+    def fields(self) -> set[str]:
+        return {field for _, field in self._fields}
+
+    def render(self, context: dict) -> str:
+        parts = list(self._parts)
+        for index, field in self._fields:
+            try:
+                value = context[field]
+            except KeyError:
+                raise KeyError(f"Template {self.name} needs ${field}") from None
+            if self.autoescape and not isinstance(value, Safe):
+                value = html.escape(str(value))
+            parts[index] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
+
+
+def load_template(name: str) -> tuple[CompiledTemplate, CompiledTemplate]:
+    """Compile the text and HTML bodies for `name`."""
+    compiled = []
+    for extension in ("txt", "html"):
+        with open(os.path.join(EMAIL_TEMPLATE_DIR, f"{name}.{extension}"), encoding="utf-8") as f:
+            compiled.append(CompiledTemplate(f"{name}.{extension}", f.read(), autoescape=extension == "html"))
+    return compiled[0], compiled[1]
+
+
+class Notification:
+    """
+    One kind of email: a subject template, a pair of body templates and a
+    recipient. `to` is a context field holding the address, a literal
+    address, or None for the sender's own mailbox.
+    """
+
+    def __init__(self, subject: str, body: str, to: str | None = None):
+        self.subject = CompiledTemplate(f"{body} subject", subject)
+        self.body = body
+        self.to = to
+
+    def recipient(self, context: dict, sender: str) -> str:
+        if self.to is None:
+            return sender
+        return context[self.to] if self.to in context else self.to
+
+
+# Every template is compiled once, at import:
+NOTIFICATIONS = {
+    "order_confirmation": Notification(
+        "Tribelet Order Confirmation - $order_id", "order_confirmation", to="customer_email"
+    ),
+    # The business copy is the customer's email, with its own subject:
+    "order_business_copy": Notification(
+        "New Order - $order_id from $customer_name", "order_confirmation"
+    ),
+    "order_processing": Notification(
+        "🚨 New Order to Process - $order_id", "order_processing", to=ORDER_PROCESSING_EMAIL
+    ),
+    # Digest mode replaces the two above with one summary per batch of orders:
+    "order_digest": Notification(
+        "🚨 $order_count New Orders to Process - £$revenue", "order_digest", to=ORDER_PROCESSING_EMAIL
+    ),
+    "order_digest_business_copy": Notification(
+        "Order Digest - $order_count orders, £$revenue", "order_digest"
+    ),
+}
+TEMPLATES = {notification.body: load_template(notification.body) for notification in NOTIFICATIONS.values()}
+
+
+def render_notifications(names: list[str], context: dict, sender: str) -> list:
+    """
+    Build a MIME message per notification name. Notifications sharing a
+    body render it once and share the MIME parts.
+    """
+    rendered = {}
+    messages = []
+    for name in names:
+        notification = NOTIFICATIONS[name]
+        parts = rendered.get(notification.body)
+        if parts is None:
+            text, html_body = TEMPLATES[notification.body]
+            parts = rendered[notification.body] = (
+                MIMEText(text.render(context), "plain"),
+                MIMEText(html_body.render(context), "html"),
+            )
+
+        # A random boundary spares the generator from scanning the body for one:
+        message = MIMEMultipart("alternative", boundary=f"==={uuid.uuid4().hex}===")
+        message["Subject"] = notification.subject.render(context)
+        message["From"] = sender
+        message["To"] = notification.recipient(context, sender)
+        message.attach(parts[0])
+        message.attach(parts[1])
+        messages.append(message)
+    return messages
+
+
+def order_context(order_data: dict) -> dict:
+    """
+    Everything the order templates use, computed once per order: the
+    quantity lines and tables, formatted totals and the yes/no wordings
+    the customer and processing emails each use.
+    """
+    ordered = [(size, qty) for size, qty in order_data['quantities'].items() if qty > 0]
+    escaped = [(html.escape(str(size)), qty) for size, qty in ordered]
+    print_enabled = order_data['back_print_enabled']
+    print_text = order_data['back_print_text']
+    position = order_data['back_print_position']
+
+    context = {
+        field: order_data[field]
+        for field in (
+            "order_id", "customer_name", "customer_email", "kit_type", "team_name",
+            "design_name", "teamwear_color", "emblem_color"
+        )
+    }
+    context.update(
+        back_print_position=position,
+        date=datetime.now().strftime('%Y-%m-%d %H:%M'),
+        subtotal=f"{order_data['subtotal']:.2f}",
+        tax=f"{order_data['tax']:.2f}",
+        total=f"{order_data['total']:.2f}",
+        total_items=sum(qty for _, qty in ordered),
+        quantities_text="\n".join(f"{size}: {qty}" for size, qty in ordered),
+        quantity_rows=Safe("".join(
+            f'<tr><td style="padding: 5px 0;">{size}:</td><td style="text-align: right;">{qty}</td></tr>'
+            for size, qty in escaped
+        )),
+        quantity_unit_rows=Safe("".join(
+            f'<tr><td style="padding: 5px 0; font-weight: bold;">{size}:</td><td style="text-align: right;">{qty} units</td></tr>'
+            for size, qty in escaped
+        )),
+        back_print=print_text if print_enabled else "None",
+        back_print_flag=print_text if print_enabled else "NONE",
+        back_print_summary=f'"{print_text}" at {position}%' if print_enabled else "None",
+        back_print_detail=f"{print_text} (Position: {position}%)" if print_enabled else "None",
+    )
+    for field in ("front_image", "back_image"):
+        chosen = bool(order_data[field])
+        context[field] = "Yes" if chosen else "No"
+        context[f"{field}_flag"] = "YES" if chosen else "NO"
+        context[f"{field}_badge"] = "✅ YES" if chosen else "❌ NO"
+    return context
+
+
+def digest_entry(order_data: dict) -> dict:
+    """The part of an order a digest needs, as plain JSON."""
+    return {
+        "order_id": order_data['order_id'],
+        "date": datetime.now().strftime('%Y-%m-%d %H:%M'),
+        "customer_name": order_data['customer_name'],
+        "customer_email": order_data['customer_email'],
+        "kit_type": order_data['kit_type'],
+        "team_name": order_data['team_name'],
+        "back_print": order_data['back_print_text'] if order_data['back_print_enabled'] else None,
+        "quantities": {str(size): qty for size, qty in order_data['quantities'].items() if qty > 0},
+        "total": order_data['total'],
+    }
+
+
+def digest_context(entries: list[dict]) -> dict:
+    """Context for the order digest templates: one line per order plus size and revenue totals."""
+    size_totals = {}
+    lines = []
+    rows = []
+    for entry in entries:
+        for size, qty in entry["quantities"].items():
+            size_totals[size] = size_totals.get(size, 0) + qty
+        sizes = ", ".join(f"{size}: {qty}" for size, qty in entry["quantities"].items())
+        back_print = f' / print "{entry["back_print"]}"' if entry["back_print"] else ""
+        lines.append(
+            f"- {entry['order_id']} ({entry['date']}) {entry['customer_name']} <{entry['customer_email']}> - "
+            f"{entry['kit_type']}, {entry['team_name']}{back_print} - {sizes} - £{entry['total']:.2f}"
+        )
+        rows.append(
+            f'<tr style="border-bottom: 1px solid #eee;"><td style="padding: 5px;">{html.escape(entry["order_id"])}'
+            f'<br><span style="color: #999;">{html.escape(entry["date"])}</span></td>'
+            f'<td style="padding: 5px;">{html.escape(entry["customer_name"])}<br>'
+            f'<a href="mailto:{html.escape(entry["customer_email"])}">{html.escape(entry["customer_email"])}</a></td>'
+            f'<td style="padding: 5px;">{html.escape(entry["kit_type"])}<br>{html.escape(entry["team_name"])}'
+            f'{html.escape(back_print)}</td>'
+            f'<td style="padding: 5px;">{html.escape(sizes)}</td>'
+            f'<td style="padding: 5px; text-align: right;">£{entry["total"]:.2f}</td></tr>'
+        )
+
+    return {
+        "order_count": len(entries),
+        "first_date": entries[0]["date"] if entries else "",
+        "last_date": entries[-1]["date"] if entries else "",
+        "total_items": sum(size_totals.values()),
+        "revenue": f"{sum(entry['total'] for entry in entries):.2f}",
+        "order_lines": "\n".join(lines),
+        "order_rows": Safe("".join(rows)),
+        "size_lines": "\n".join(f"{size}: {qty}" for size, qty in size_totals.items()),
+        "size_rows": Safe("".join(
+            f'<tr><td style="padding: 5px 0; font-weight: bold;">{html.escape(size)}:</td><td style="text-align: right;">{qty} units</td></tr>'
+            for size, qty in size_totals.items()
+        )),
+    }
@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from deadlines import remaining, DeadlineExceeded
+
+# Hedge once the first attempt is slower than this latency percentile:
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# Latencies needed (per helper) before hedging kicks in:
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "16"))
+# At most this fraction of calls may start a second attempt:
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+
+
+class Hedger:
+    """
+    Hedged calls: if the first attempt runs past the `percentile` latency
+    seen so far for that name, start a second, identical attempt and
+    return whichever succeeds first. The loser is left to finish and its
+    result discarded.
+
+    The delay counts from when the first attempt starts running, not from
+    when it was queued. With no free pool thread the call runs inline and
+    unhedged, and hedges stop once `budget` of the calls have used one.
+    """
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 window: int = 200, pool_size: int = HEDGE_POOL_SIZE, budget: float = HEDGE_BUDGET):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.pool_size = pool_size
+        self.budget = budget
+        self._samples = {}
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="hedge")
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "hedge_skipped": 0}
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, name: str) -> float | None:
+        """The latency after which a second attempt starts, or None if there's too little history."""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+    def _free_thread(self) -> bool:
+        with self._lock:
+            return self._busy < self.pool_size
+
+    def _submit(self, func):
+        context = contextvars.copy_context()
+        running = threading.Event()
+
+        def run():
+            running.started = time.perf_counter()
+            running.set()
+            try:
+                return context.run(func)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+        with self._lock:
+            self._busy += 1
+        future = self._executor.submit(run)
+        future.running = running
+        return future
+
+    def call(self, name: str, func):
+        self.stats["calls"] += 1
+        delay = self.hedge_delay(name)
+        if delay is None or not self._free_thread():
+            started = time.perf_counter()
+            result = func()
+            self.record(name, time.perf_counter() - started)
+            return result
+
+        attempts = [self._submit(func)]
+        left = remaining()
+        attempts[0].running.wait(None if left is None else max(left, 0))
+        left = remaining()
+        done, _ = wait(attempts, timeout=delay if left is None else min(delay, max(left, 0)))
+        if not done:
+            if self._free_thread() and self.stats["hedged"] < self.budget * self.stats["calls"]:
+                self.stats["hedged"] += 1
+                attempts.append(self._submit(func))
+            else:
+                self.stats["hedge_skipped"] += 1
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Request deadline exceeded")
+            for future in done:
+                if future.exception() is None:
+                    self.record(name, time.perf_counter() - future.running.started)
+                    if future is not attempts[0]:
+                        self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
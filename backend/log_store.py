@@ -0,0 +1,397 @@
+import os
+import io
+import csv
+import json
+import uuid
+import time
+import threading
+import botocore
+from datetime import datetime, timedelta
+
+from s3_writes import put_if_absent, put_if_match
+from s3_objects import time_key, parse_time_key, list_keys, delete_keys
+
+# Compaction settings (seconds / counts):
+COMPACTION_INTERVAL = int(os.getenv("LOG_COMPACTION_INTERVAL", "300"))
+COMPACTION_GRACE = int(os.getenv("LOG_COMPACTION_GRACE", "60"))
+COMPACTION_MAX_FILES = int(os.getenv("LOG_COMPACTION_MAX_FILES", "8"))
+
+
+class SegmentVanished(Exception):
+    """Raised when a segment or compacted file disappears mid-read (compaction raced us)."""
+
+
+class SegmentLog:
+    """
+    Append-only CSV log stored as immutable segment objects under an S3 prefix.
+
+    Layout:
+        {prefix}/segments/{time}-{id}.csv   one object per append (header + rows)
+        {prefix}/compacted/{time}.csv       merged, timestamp-sorted segments
+        {prefix}/manifest.json              compacted files + segment watermark
+
+    Readers scan the manifest's files, then every segment after the watermark.
+    Writers never read anything, so an append costs one small PUT no matter how
+    large the log is.
+    """
+
+    def __init__(self, client, bucket: str, prefix: str, columns: list[str],
+                 legacy_key: str | None = None, sort_key: str = "timestamp"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.columns = columns
+        self.legacy_key = legacy_key
+        self.sort_key = sort_key
+
+    # --- Keys ---
+
+    @property
+    def manifest_key(self) -> str:
+        return f"{self.prefix}/manifest.json"
+
+    @property
+    def segment_prefix(self) -> str:
+        return f"{self.prefix}/segments/"
+
+    def _new_segment_key(self) -> str:
+        # Segment keys sort lexicographically in write order:
+        return f"{self.segment_prefix}{time_key()}-{uuid.uuid4().hex[:12]}.csv"
+
+    # --- Writing ---
+
+    def _to_csv(self, rows: list[list], columns: list[str]) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        writer.writerows(rows)
+        return output.getvalue()
+
+    def append(self, row: list) -> str:
+        """
+        Write a single row as a new immutable segment.
+
+        Segments are created with If-None-Match so two writers can never
+        overwrite each other, even on a key collision.
+
+        Args:
+            row (list): Values in the same order as the log's columns
+
+        Returns:
+            str: The S3 key of the new segment
+        """
+        body = self._to_csv([row], self.columns)
+        while True:
+            key = self._new_segment_key()
+            if put_if_absent(self.client, self.bucket, key, body, ContentType="text/csv"):
+                return key
+
+    # --- Reading ---
+
+    def load_manifest(self) -> dict:
+        return self._get_manifest()[0]
+
+    def _get_manifest(self, if_none_match: str | None = None) -> tuple[dict | None, str | None]:
+        """
+        Fetch the manifest and its ETag.
+
+        When `if_none_match` equals the current ETag nothing is downloaded and
+        (None, etag) is returned.
+        """
+        params = {"Bucket": self.bucket, "Key": self.manifest_key}
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            response = self.client.get_object(**params)
+            return json.loads(response["Body"].read().decode("utf-8")), response["ETag"]
+        except self.client.exceptions.NoSuchKey:
+            # No compaction has happened yet; the legacy single-file log is the base:
+            return {
+                "files": [self.legacy_key] if self.legacy_key else [],
+                "watermark": "",
+            }, None
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return None, if_none_match
+            raise
+
+    def _manifest_etag(self) -> str | None:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.manifest_key)["ETag"]
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def list_segments(self, after: str = "") -> list[str]:
+        return list_keys(self.client, self.bucket, self.segment_prefix, start_after=after)
+
+    def _read_csv(self, key: str, missing_ok: bool = False) -> list[dict]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            if missing_ok:
+                return []
+            raise SegmentVanished(key)
+        csv_text = response["Body"].read().decode("utf-8")
+        return list(csv.DictReader(io.StringIO(csv_text)))
+
+    def _segment_floor(self, key: str, grace_seconds: int) -> str:
+        # Segment keys are stamped when the write starts, so a slow PUT can become
+        # visible after a later key. Re-list a grace window behind the newest key.
+        stamp = key[len(self.segment_prefix):].split("-", 1)[0]
+        try:
+            floor = parse_time_key(stamp) - timedelta(seconds=grace_seconds)
+        except ValueError:
+            return key
+        return f"{self.segment_prefix}{time_key(floor)}"
+
+    def read_changes(self, cursor: dict | None = None,
+                     grace_seconds: int = COMPACTION_GRACE) -> tuple[list[dict], dict, bool]:
+        """
+        Incrementally read rows added since `cursor`.
+
+        Only segments newer than the cursor are downloaded; the manifest is
+        fetched conditionally on its ETag, so an unchanged log costs one 304, one
+        LIST and a HEAD confirming no compaction committed mid-read. A compaction that only merged segments we have already seen
+        does not force a reload.
+
+        Args:
+            cursor (dict | None): Cursor returned by the previous call, or None
+
+        Returns:
+            tuple: (rows, new cursor, full) where `full` means the rows are the
+                   whole log and any state built from older rows must be reset
+        """
+        if cursor is None:
+            return self._read_full()
+
+        for attempt in range(3):
+            result = self._read_changes_once(cursor, grace_seconds)
+            if result is not None:
+                return result
+        return self._read_full()
+
+    def _read_changes_once(self, cursor: dict, grace_seconds: int) -> tuple[list[dict], dict, bool] | None:
+        # None means a compaction committed mid-read; the caller starts over.
+        manifest, etag = self._get_manifest(if_none_match=cursor["etag"])
+        if manifest is not None and etag != cursor["etag"]:
+            if manifest["watermark"] > cursor["last_segment"]:
+                # Compaction merged segments we never saw; start over.
+                return self._read_full()
+            cursor = dict(cursor, etag=etag, watermark=manifest["watermark"])
+
+        after = max(cursor["watermark"], self._segment_floor(cursor["last_segment"], grace_seconds)) \
+            if cursor["last_segment"] else cursor["watermark"]
+        seen = set(cursor["seen"])
+        rows = []
+        try:
+            new_keys = [key for key in self.list_segments(after=after) if key not in seen]
+            for key in new_keys:
+                rows.extend(self._read_csv(key))
+        except SegmentVanished:
+            return self._read_full()
+
+        # A compaction that committed after the manifest read may have deleted
+        # segments before they were listed; they'd be missing without an error.
+        if self._manifest_etag() != cursor["etag"]:
+            return None
+
+        seen.update(new_keys)
+        last_segment = max([cursor["last_segment"], *new_keys])
+        floor = self._segment_floor(last_segment, grace_seconds) if last_segment else ""
+        return rows, dict(
+            cursor,
+            last_segment=last_segment,
+            seen=sorted(key for key in seen if key >= floor),
+        ), False
+
+    def _read_full(self, attempts: int = 3) -> tuple[list[dict], dict, bool]:
+        for attempt in range(attempts):
+            manifest, etag = self._get_manifest()
+            try:
+                rows = []
+                for key in manifest["files"]:
+                    rows.extend(self._read_csv(key, missing_ok=(key == self.legacy_key)))
+                segments = self.list_segments(after=manifest["watermark"])
+                for key in segments:
+                    rows.extend(self._read_csv(key))
+            except SegmentVanished as e:
+                print(f"Log {self.prefix} changed during read ({e}), retrying...")
+                continue
+            # Segments compacted (and deleted) between the manifest read and the
+            # listing would otherwise vanish silently:
+            if self._manifest_etag() != etag:
+                print(f"Log {self.prefix} compacted during read, retrying...")
+                continue
+
+            last_segment = segments[-1] if segments else manifest["watermark"]
+            return rows, {
+                "etag": etag,
+                "watermark": manifest["watermark"],
+                "last_segment": last_segment,
+                "seen": segments,
+            }, True
+        raise SegmentVanished(self.prefix)
+
+    def read_rows(self) -> list[dict]:
+        """
+        Return every row in the log: compacted files first, then live segments.
+
+        A compaction running concurrently can delete objects we are about to
+        read; when that happens the manifest is reloaded and the read restarted.
+        """
+        return self._read_full()[0]
+
+    # --- Compaction ---
+
+    def compact(self, grace_seconds: int = COMPACTION_GRACE,
+                max_files: int = COMPACTION_MAX_FILES) -> int:
+        """
+        Merge settled segments into a sorted compacted file and advance the watermark.
+
+        Segments younger than `grace_seconds` are left alone so that in-flight
+        appends (whose keys were stamped slightly earlier) are never skipped.
+        Once the manifest holds more than `max_files` files they are all merged
+        into one.
+
+        Returns:
+            int: Number of segments merged
+        """
+        manifest, etag = self._get_manifest()
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        cutoff_key = f"{self.segment_prefix}{time_key(cutoff)}"
+
+        segments = [key for key in self.list_segments(after=manifest["watermark"]) if key < cutoff_key]
+        if not segments:
+            return 0
+
+        files = list(manifest["files"])
+        if len(files) + 1 > max_files:
+            # Full merge: fold the existing compacted files in as well.
+            merge_files, keep_files = files, []
+        else:
+            merge_files, keep_files = [], files
+
+        rows = []
+        try:
+            for key in merge_files:
+                rows.extend(self._read_csv(key, missing_ok=(key == self.legacy_key)))
+        except SegmentVanished:
+            # Another worker is compacting the same files.
+            return 0
+        for key in segments:
+            rows.extend(self._read_csv(key, missing_ok=True))
+        rows.sort(key=lambda row: row.get(self.sort_key) or "")
+
+        # Later segments may carry columns older files don't have:
+        columns = list(self.columns)
+        for row in rows:
+            columns.extend(column for column in row if column not in columns)
+
+        new_key = f"{self.prefix}/compacted/{time_key()}.csv"
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=new_key,
+            Body=self._to_csv([[row.get(column, "") for column in columns] for row in rows], columns),
+            ContentType="text/csv"
+        )
+
+        # Commit only if no other worker changed the manifest since we read it:
+        committed = put_if_match(
+            self.client, self.bucket, self.manifest_key,
+            json.dumps({
+                "files": keep_files + [new_key],
+                "watermark": segments[-1],
+                "updated_at": datetime.utcnow().isoformat(),
+            }),
+            etag,
+            ContentType="application/json"
+        )
+        if not committed:
+            self.client.delete_object(Bucket=self.bucket, Key=new_key)
+            print(f"Compaction of {self.prefix} lost a race with another worker, skipping")
+            return 0
+
+        # The legacy log is kept as an archive; everything else we merged can go.
+        obsolete = [key for key in merge_files if key != self.legacy_key] + segments
+        delete_keys(self.client, self.bucket, obsolete)
+
+        print(f"Compacted {len(segments)} segments into {new_key}")
+        return len(segments)
+
+
+class LogIndex:
+    """
+    Base class for in-memory indexes built from a SegmentLog.
+
+    The index is loaded once and then refreshed incrementally with
+    `SegmentLog.read_changes`, at most once every `max_staleness` seconds.
+    Subclasses implement `reset` and `add_rows`.
+    """
+
+    def __init__(self, log: SegmentLog, max_staleness: float):
+        self.log = log
+        self.max_staleness = max_staleness
+        self._cursor = None
+        self._refreshed_at = None
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "full_loads": 0}
+
+    def reset(self):
+        raise NotImplementedError
+
+    def add_rows(self, rows: list[dict]):
+        raise NotImplementedError
+
+    @property
+    def age(self) -> float:
+        if self._refreshed_at is None:
+            return float("inf")
+        return time.monotonic() - self._refreshed_at
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            if not force and self.age < self.max_staleness:
+                return
+            rows, cursor, full = self.log.read_changes(self._cursor)
+            if full:
+                self.reset()
+                self.stats["full_loads"] += 1
+            self.add_rows(rows)
+            self._cursor = cursor
+            self._refreshed_at = time.monotonic()
+            self.stats["refreshes"] += 1
+
+
+# Background compaction loop for all logs:
+def start_compaction_worker(logs: list[SegmentLog], interval: int = COMPACTION_INTERVAL,
+                            tasks: list = ()) -> threading.Event:
+    """
+    Start a daemon thread that compacts each log every `interval` seconds.
+
+    Args:
+        logs (list): Logs to compact
+        interval (int): Seconds between passes
+        tasks (list): Extra zero-argument maintenance callables run after each pass
+
+    Returns:
+        threading.Event: Set it to stop the worker
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            for log in logs:
+                try:
+                    log.compact()
+                except Exception as e:
+                    print(f"Compaction of {log.prefix} failed: {e}")
+            for task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    print(f"Maintenance task {getattr(task, '__qualname__', task)} failed: {e}")
+
+    threading.Thread(target=run, name="log-compaction", daemon=True).start()
+    return stop
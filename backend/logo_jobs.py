@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import base64
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+from async_storage import run_storage
+from aws_s3 import s3, AWS_BUCKET
+from s3_writes import put_if_absent, update_object
+from s3_objects import list_keys, delete_older_than
+from logo_pipeline import stage_logo, LOGO_STAGING_TTL
+from openai_utils import generate_short_summary, generate_logo_image
+from deadlines import deadline
+
+# Job records (one JSON object per job, shared by every API worker):
+LOGO_JOB_PREFIX = "jobs/logos/"
+# Jobs generating at once per API worker, and how many may wait behind them:
+LOGO_JOB_WORKERS = int(os.getenv("LOGO_JOB_WORKERS", "2"))
+LOGO_JOB_QUEUE_LIMIT = int(os.getenv("LOGO_JOB_QUEUE_LIMIT", "100"))
+# Seconds a job record lives; results point at staged logos, so they expire together:
+LOGO_JOB_TTL = int(os.getenv("LOGO_JOB_TTL", str(LOGO_STAGING_TTL)))
+# Time budget for one job's upstream calls:
+LOGO_JOB_DEADLINE = float(os.getenv("LOGO_JOB_DEADLINE", "600"))
+# A running job not updated for this long is assumed lost (its worker restarted):
+LOGO_JOB_STALE_AFTER = int(os.getenv("LOGO_JOB_STALE_AFTER", "900"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"
+PENDING = {QUEUED, RUNNING}
+
+
+class JobQueueFull(Exception):
+    pass
+
+class _JobCancelled(Exception):
+    pass
+
+
+def logo_job_key(job_id: str) -> str:
+    return f"{LOGO_JOB_PREFIX}{job_id}.json"
+
+def read_logo_job(job_id: str) -> dict | None:
+    """
+    Load a job record, or None if it doesn't exist.
+    Records past `expires_at` are reported with status "expired".
+    """
+    if not job_id.isalnum():
+        return None
+    try:
+        response = s3.get_object(Bucket=AWS_BUCKET, Key=logo_job_key(job_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+
+    record = json.loads(response["Body"].read().decode("utf-8"))
+    if record["expires_at"] < time.time():
+        record["status"] = EXPIRED
+    return record
+
+def _transition(job_id: str, allowed: set[str], **changes) -> dict | None:
+    """
+    Move a job to a new state if it is currently in one of `allowed` (and
+    not expired). Conditional, so concurrent workers can't both claim a job.
+
+    Returns:
+        dict: The updated record, or None if the transition didn't apply
+    """
+    def mutate(current):
+        if current is None:
+            return None
+        record = json.loads(current)
+        if record["status"] not in allowed or record["expires_at"] < time.time():
+            return None
+        record.update(changes, updated_at=time.time())
+        return json.dumps(record).encode("utf-8")
+
+    body = update_object(s3, AWS_BUCKET, logo_job_key(job_id), mutate, ContentType="application/json")
+    return json.loads(body) if body is not None else None
+
+
+class LogoJobQueue:
+    """
+    Runs logo generation jobs in the background.
+
+    Submitting writes a "queued" record to S3 and returns straight away; a
+    fixed number of worker tasks pick jobs up, claim them with a conditional
+    write, and record the staged logos (or the error) when they finish.
+    Status lives only in S3, so any API worker can answer polls or cancel.
+    """
+
+    def __init__(self, workers: int = LOGO_JOB_WORKERS, limit: int = LOGO_JOB_QUEUE_LIMIT):
+        self.workers = workers
+        self.limit = limit
+        self._queue = None
+        self._tasks = []
+        self._running = {}
+        self._cancelled = set()
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, prompt: str, team_name: str, count: int) -> dict:
+        if self.depth() >= self.limit:
+            raise JobQueueFull(f"{self.depth()} logo jobs already queued")
+
+        now = time.time()
+        record = {
+            "job_id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "prompt": prompt,
+            "team_name": team_name,
+            "count": count,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + LOGO_JOB_TTL,
+        }
+        await run_storage(
+            put_if_absent, s3, AWS_BUCKET, logo_job_key(record["job_id"]),
+            json.dumps(record).encode("utf-8"), ContentType="application/json"
+        )
+        self._queue.put_nowait(record["job_id"])
+        self.stats["submitted"] += 1
+        return record
+
+    async def cancel(self, job_id: str) -> dict | None:
+        """Cancel a queued or running job. Returns the updated record, or None if it had already finished."""
+        record = await run_storage(_transition, job_id, PENDING, status=CANCELLED, finished_at=time.time())
+        if record is not None:
+            self.stats["cancelled"] += 1
+            task = self._running.get(job_id)
+            if task is not None:
+                self._cancelled.add(job_id)
+                task.cancel()
+        return record
+
+    async def recover(self):
+        """
+        Requeue jobs left "queued" by a restarted worker and fail ones stuck
+        "running". Every API worker may do this; claiming keeps it safe.
+        """
+        def scan():
+            keys = list_keys(s3, AWS_BUCKET, LOGO_JOB_PREFIX)
+            return [record for record in (read_logo_job(key[len(LOGO_JOB_PREFIX):-5]) for key in keys) if record]
+
+        for record in await run_storage(scan):
+            if record["status"] == QUEUED:
+                self._queue.put_nowait(record["job_id"])
+            elif record["status"] == RUNNING and record["updated_at"] < time.time() - LOGO_JOB_STALE_AFTER:
+                await run_storage(
+                    _transition, record["job_id"], {RUNNING},
+                    status=FAILED, error="Job was interrupted, please try again.", finished_at=time.time()
+                )
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            job_id = await queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Logo job {job_id} error: {e}")
+            finally:
+                queue.task_done()
+
+    async def _run(self, job_id: str):
+        # Claim it (skips jobs cancelled, expired or taken by another worker):
+        record = await run_storage(_transition, job_id, {QUEUED}, status=RUNNING, started_at=time.time())
+        if record is None:
+            return
+
+        task = asyncio.ensure_future(self._generate(record))
+        self._running[job_id] = task
+        try:
+            summary, logos = await task
+        except _JobCancelled:
+            print(f"Logo job {job_id} cancelled")
+            return
+        except asyncio.CancelledError:
+            # Cancelled by cancel(), or the worker itself is shutting down:
+            if job_id not in self._cancelled:
+                raise
+            print(f"Logo job {job_id} cancelled")
+            return
+        except Exception as e:
+            print(f"Logo job {job_id} failed: {e}")
+            self.stats["failed"] += 1
+            await run_storage(_transition, job_id, {RUNNING}, status=FAILED, error=str(e), finished_at=time.time())
+            return
+        finally:
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+
+        finished = time.time()
+        done = await run_storage(
+            _transition, job_id, {RUNNING},
+            status=SUCCEEDED, summary=summary, logos=logos,
+            finished_at=finished, expires_at=finished + LOGO_STAGING_TTL
+        )
+        if done is not None:
+            self.stats["succeeded"] += 1
+
+    async def _generate(self, record: dict) -> tuple[str, list[dict]]:
+        with deadline(LOGO_JOB_DEADLINE):
+            return await self._generate_within_deadline(record)
+
+    async def _generate_within_deadline(self, record: dict) -> tuple[str, list[dict]]:
+        summary = await run_in_threadpool(generate_short_summary, record["prompt"])
+
+        # Don't start the expensive part if it was cancelled from another worker:
+        current = await run_storage(read_logo_job, record["job_id"])
+        if current is None or current["status"] != RUNNING:
+            raise _JobCancelled()
+
+        images = await run_in_threadpool(
+            generate_logo_image, prompt=summary, team_name=record["team_name"], count=record["count"]
+        )
+        if not images:
+            raise Exception("No logos were generated")
+        logos = await asyncio.gather(*[stage_logo(base64.b64decode(image)) for image in images])
+        return summary, logos
+
+LOGO_JOBS = LogoJobQueue()
+
+
+# Delete job records older than the TTL:
+def cleanup_logo_jobs(max_age: int = LOGO_JOB_TTL) -> int:
+    return delete_older_than(s3, AWS_BUCKET, LOGO_JOB_PREFIX, max_age)
@@ -0,0 +1,226 @@
+import os
+import io
+import uuid
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from async_storage import run_storage
+from aws_s3 import (
+    s3,
+    AWS_BUCKET,
+    LOGO_CACHE_CONTROL,
+    logo_key_for_digest,
+    public_url,
+    object_exists,
+    store_logo_bytes
+)
+from s3_writes import put_if_absent
+from s3_objects import delete_older_than
+
+# Longest edge (px) of each pre-sized variant; None keeps the original size:
+LOGO_VARIANTS = {
+    "thumbnail": 128,
+    "preview": 512,
+    "print": None,
+}
+LOGO_PROCESS_POOL_SIZE = int(os.getenv("LOGO_PROCESS_POOL_SIZE", "2"))
+
+# Generated-but-unsaved logos live here until promoted or expired (seconds):
+LOGO_STAGING_PREFIX = "staging/logos/"
+LOGO_STAGING_TTL = int(os.getenv("LOGO_STAGING_TTL", "3600"))
+
+_process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # Never fork the threaded server: a child could inherit a lock held by
+        # another thread (boto3 pools, flush workers) and deadlock on it.
+        _process_pool = ProcessPoolExecutor(
+            max_workers=LOGO_PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+
+
+# --- Image processing (runs in worker processes) ---
+
+def _encode_png(image: Image.Image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+def _palette(image: Image.Image) -> Image.Image:
+    # FASTOCTREE is the quantizer that keeps the alpha channel:
+    return image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+def process_logo(image_data: bytes) -> dict[str, bytes]:
+    """
+    Build every variant in LOGO_VARIANTS from one PNG.
+
+    The print master is optimised losslessly at full size (palette-encoded only
+    when the image already has 256 colours or fewer). Smaller variants are
+    resized and palette-quantised, keeping transparency.
+
+    Returns:
+        dict: Variant name -> PNG bytes
+    """
+    with Image.open(io.BytesIO(image_data)) as source:
+        image = source.convert("RGBA")
+
+    variants = {}
+    for name, size in LOGO_VARIANTS.items():
+        if size is None:
+            master = image
+            if image.getcolors(256) is not None:
+                # Use the palette only if it round-trips pixel-for-pixel:
+                paletted = _palette(image)
+                if paletted.convert("RGBA").tobytes() == image.tobytes():
+                    master = paletted
+            variants[name] = _encode_png(master)
+        else:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            variants[name] = _encode_png(_palette(resized))
+    return variants
+
+
+# --- Upload ---
+
+def variant_key_for_digest(digest: str, name: str) -> str:
+    return logo_key_for_digest(digest).removesuffix(".png") + f"/{name}.png"
+
+def variant_key(image_data: bytes, name: str) -> str:
+    return variant_key_for_digest(hashlib.sha256(image_data).hexdigest(), name)
+
+def _store_variant(key: str, body: bytes):
+    put_if_absent(s3, AWS_BUCKET, key, body, ContentType="image/png", CacheControl=LOGO_CACHE_CONTROL)
+
+async def store_logo_with_variants(image_data: bytes) -> tuple[str, dict[str, str]]:
+    """
+    Store the original logo plus its optimised, pre-sized variants.
+
+    Image work runs in the logo process pool; uploads go through the storage
+    pool. Variants already stored for these exact bytes are not rebuilt.
+
+    Returns:
+        tuple: (original URL, {variant name: URL})
+    """
+    original_url = await run_storage(store_logo_bytes, image_data)
+    keys = {name: variant_key(image_data, name) for name in LOGO_VARIANTS}
+    urls = {name: public_url(key) for name, key in keys.items()}
+
+    # The print master is written last, so its presence means the set is complete:
+    if await run_storage(object_exists, keys["print"]):
+        return original_url, urls
+
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(get_process_pool(), process_logo, image_data)
+
+    await asyncio.gather(*[
+        run_storage(_store_variant, keys[name], body)
+        for name, body in variants.items() if name != "print"
+    ])
+    await run_storage(_store_variant, keys["print"], variants["print"])
+    return original_url, urls
+
+
+# --- Staging ---
+
+def _staged_key(logo_id: str, name: str) -> str:
+    return f"{LOGO_STAGING_PREFIX}{logo_id}/{name}.png"
+
+def _put_staged(key: str, body: bytes, digest: str):
+    s3.put_object(
+        Bucket=AWS_BUCKET,
+        Key=key,
+        Body=body,
+        ContentType="image/png",
+        Metadata={"sha256": digest}
+    )
+
+def _preview_url(logo_id: str) -> str:
+    return s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": AWS_BUCKET, "Key": _staged_key(logo_id, "preview")},
+        ExpiresIn=LOGO_STAGING_TTL
+    )
+
+async def stage_logo(image_data: bytes) -> dict:
+    """
+    Stage a freshly generated logo server-side instead of sending it to the browser.
+
+    The original and all variants are written under a random staging ID; the
+    browser only gets the ID and a short-lived preview URL.
+
+    Returns:
+        dict: {"logo_id": ..., "preview_url": ...}
+    """
+    logo_id = uuid.uuid4().hex
+    digest = hashlib.sha256(image_data).hexdigest()
+
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(get_process_pool(), process_logo, image_data)
+
+    await asyncio.gather(
+        run_storage(_put_staged, _staged_key(logo_id, "original"), image_data, digest),
+        *[run_storage(_put_staged, _staged_key(logo_id, name), body, digest) for name, body in variants.items()]
+    )
+    return {"logo_id": logo_id, "preview_url": _preview_url(logo_id)}
+
+def _copy_if_absent(source: str, destination: str):
+    if object_exists(destination):
+        return
+    s3.copy_object(
+        Bucket=AWS_BUCKET,
+        Key=destination,
+        CopySource={"Bucket": AWS_BUCKET, "Key": source},
+        MetadataDirective="REPLACE",
+        ContentType="image/png",
+        CacheControl=LOGO_CACHE_CONTROL
+    )
+
+def _staged_digest(logo_id: str) -> str:
+    try:
+        head = s3.head_object(Bucket=AWS_BUCKET, Key=_staged_key(logo_id, "original"))
+    except Exception:
+        raise ValueError(f"Unknown or expired logo_id: {logo_id}")
+    return head["Metadata"]["sha256"]
+
+async def promote_staged_logo(logo_id: str) -> tuple[str, dict[str, str]]:
+    """
+    Promote a staged logo to its permanent content-addressed keys with
+    server-side copies (the bytes never leave S3).
+
+    Returns:
+        tuple: (original URL, {variant name: URL})
+    """
+    if not logo_id.isalnum():
+        raise ValueError(f"Invalid logo_id: {logo_id}")
+    digest = await run_storage(_staged_digest, logo_id)
+
+    original_key = logo_key_for_digest(digest)
+    keys = {name: variant_key_for_digest(digest, name) for name in LOGO_VARIANTS}
+
+    await asyncio.gather(
+        run_storage(_copy_if_absent, _staged_key(logo_id, "original"), original_key),
+        *[run_storage(_copy_if_absent, _staged_key(logo_id, name), keys[name]) for name in LOGO_VARIANTS if name != "print"]
+    )
+    # Print master last: its presence marks the variant set as complete.
+    await run_storage(_copy_if_absent, _staged_key(logo_id, "print"), keys["print"])
+
+    return public_url(original_key), {name: public_url(key) for name, key in keys.items()}
+
+# Delete staged logos older than the TTL (an S3 lifecycle rule on the prefix works too):
+def cleanup_staged_logos(max_age: int = LOGO_STAGING_TTL) -> int:
+    return delete_older_than(s3, AWS_BUCKET, LOGO_STAGING_PREFIX, max_age)
@@ -1,17 +1,26 @@
 # --- Required packages ---
-from email_utils import send_order_confirmation_email, save_order_to_s3
+from email_utils import queue_order_confirmation_email, save_order_to_s3, ORDER_LOG, OUTBOX, DIGEST
+from order_store import read_order_aggregates, read_order_record, apply_pending_aggregates
+from smtp_pool import get_smtp_pool, close_smtp_pool
 
 # Environment variables:
 from dotenv import load_dotenv
 load_dotenv()
 
 # Global packages:
-from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi import FastAPI, Query, HTTPException, Request, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel, EmailStr
 import uuid
 import base64
 import io
+import asyncio
+import time
+import json
+import math
+import hmac
+import os
 
 # AWS S3 Utilities:
 from aws_s3 import (
@@ -21,18 +30,53 @@ from aws_s3 import (
     save_team_to_s3, 
     get_user_by_credentials, 
     get_teams_by_email, 
-    upload_logo_from_base64,
-    check_team_name_in_s3
+    check_team_name_in_s3,
+    USER_LOG,
+    TEAM_LOG,
+    USER_INDEX,
+    TEAM_NAME_INDEX,
+    PROMPT_LOG
 )
 
+# Log compaction:
+from log_store import start_compaction_worker
+
+# Logo optimisation and variants:
+from logo_pipeline import (
+    store_logo_with_variants,
+    shutdown_process_pool,
+    stage_logo,
+    promote_staged_logo,
+    cleanup_staged_logos
+)
+
+# Background logo jobs:
+from logo_jobs import LOGO_JOBS, JobQueueFull, read_logo_job, cleanup_logo_jobs, PENDING, SUCCEEDED, FAILED
+
+# Non-blocking storage access:
+from async_storage import run_storage, storage_executor, LOOP_LAG, STORAGE_POOL_SIZE
+from starlette.concurrency import run_in_threadpool
+
 # Open AI Utilities:
 from openai_utils import (
     generate_summary,
-    generate_team_name,
-    generate_single_team_name,
+    generate_team_names,
     generate_short_summary,
-    generate_logo_image
+    generate_logo_image,
+    stream_summary,
+    stream_team_names,
+    split_numbered_names,
+    stream_logo_images,
+    RESPONSE_CACHE,
+    INFLIGHT,
+    SCHEDULER,
+    HEDGER
 )
+from openai_scheduler import OpenAIRateLimited, OpenAIUnavailable
+from deadlines import deadline, deadline_for_path, DeadlineExceeded
+
+# Prometheus metrics:
+import metrics
 
 # App & Handler for Zappa AWS deployment:
 app = FastAPI()
@@ -46,6 +90,122 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Every request gets a deadline; upstream calls are given whatever is left of it:
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    with deadline(deadline_for_path(request.url.path)):
+        return await call_next(request)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    print(f"Deadline exceeded for {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=504,
+        content={"error": "The request took too long, please try again."}
+    )
+
+# OpenAI rate limits / outages (raised by the call scheduler after its retries):
+@app.exception_handler(OpenAIRateLimited)
+async def openai_rate_limited(request: Request, exc: OpenAIRateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Too many generation requests, please try again shortly."},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+@app.exception_handler(OpenAIUnavailable)
+async def openai_unavailable(request: Request, exc: OpenAIUnavailable):
+    print(f"OpenAI unavailable: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Generation is temporarily unavailable, please try again later."}
+    )
+
+# Background compaction of the append-only logs:
+@app.on_event("startup")
+def start_log_compaction():
+    app.state.stop_compaction = start_compaction_worker(
+        [USER_LOG, TEAM_LOG, ORDER_LOG],
+        tasks=[TEAM_NAME_INDEX.save_snapshot, cleanup_staged_logos, cleanup_logo_jobs, apply_pending_aggregates]
+    )
+
+# Warm the user index so the first login doesn't pay for a full load:
+@app.on_event("startup")
+def warm_user_index():
+    try:
+        USER_INDEX.refresh()
+    except Exception as e:
+        print(f"User index warm-up failed: {e}")
+
+# Load the team name Bloom snapshot, then the full name set in the background:
+@app.on_event("startup")
+def warm_team_name_index():
+    try:
+        TEAM_NAME_INDEX.warm()
+    except Exception as e:
+        print(f"Team name index warm-up failed: {e}")
+
+@app.on_event("shutdown")
+def stop_log_compaction():
+    app.state.stop_compaction.set()
+
+# Write-behind prompt logging, drained on shutdown:
+@app.on_event("startup")
+def start_prompt_log():
+    PROMPT_LOG.start()
+
+@app.on_event("shutdown")
+def stop_prompt_log():
+    PROMPT_LOG.stop()
+
+# Background delivery of queued order emails:
+@app.on_event("startup")
+def start_email_outbox():
+    OUTBOX.start()
+
+@app.on_event("shutdown")
+def stop_email_outbox():
+    OUTBOX.stop()
+
+# Batched internal order notifications (NOTIFICATION_DIGEST=1):
+@app.on_event("startup")
+def start_notification_digest():
+    DIGEST.start()
+
+@app.on_event("shutdown")
+def stop_notification_digest():
+    DIGEST.stop()
+
+# Event loop lag probe:
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    LOOP_LAG.start()
+
+# Background logo jobs (resuming any a restarted worker left queued):
+@app.on_event("startup")
+async def start_logo_jobs():
+    LOGO_JOBS.start()
+    try:
+        await LOGO_JOBS.recover()
+    except Exception as e:
+        print(f"Logo job recovery failed: {e}")
+
+@app.on_event("shutdown")
+async def stop_storage_pool():
+    LOOP_LAG.stop()
+    LOGO_JOBS.stop()
+    storage_executor.shutdown(wait=True)
+    shutdown_process_pool()
+    close_smtp_pool()
+
+# --- Server-Sent Events ---
+
+# Stop proxies (nginx, ALB) from buffering the stream:
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # --- Python Classes ---
 
 # User prompt:
@@ -58,6 +218,17 @@ class LogoRequest(BaseModel):
     team_name: str
     count: int = 3  # Default to 3 logos
 
+# Whole-identity request:
+class GenerateAllRequest(BaseModel):
+    prompt: str
+    count: int = 3  # Number of logos
+
+# Background logo job:
+class LogoJobRequest(BaseModel):
+    prompt: str
+    team_name: str
+    count: int = 3  # Number of logos
+
 # Team data:
 class TeamData(BaseModel):
     team_name: str
@@ -111,6 +282,54 @@ class KitOrderRequest(BaseModel):
 async def read_root():
     return {"message": "Tribelet backend is live!"}
 
+# Event loop health (lag stays near zero unless something blocks the loop):
+@app.get("/api/health")
+async def health():
+    return {
+        "event_loop_lag": LOOP_LAG.stats(),
+        "storage_pool_size": STORAGE_POOL_SIZE
+    }
+
+# Existing in-process stats, reported alongside the OpenAI metrics:
+def collect_service_stats():
+    def counters(stats: dict, label: str, keys) -> list:
+        return [({label: key}, stats[key]) for key in keys]
+
+    lag = sorted(LOOP_LAG.samples)
+    return [
+        ("tribelet_response_cache_total", "counter", "Response cache lookups by result.",
+         counters(RESPONSE_CACHE.stats, "result", ("memory_hits", "persistent_hits", "misses"))),
+        ("tribelet_response_cache_latency_saved_seconds_total", "counter", "Upstream time saved by cache hits.",
+         [({}, RESPONSE_CACHE.stats["latency_saved_seconds"])]),
+        ("tribelet_singleflight_total", "counter", "In-flight OpenAI calls, led or coalesced.",
+         counters(INFLIGHT.stats, "kind", ("calls", "coalesced"))),
+        ("tribelet_openai_scheduler_total", "counter", "Scheduler attempts, retries, 429s and queue timeouts.",
+         counters(SCHEDULER.stats, "kind", ("calls", "retries", "rate_limited", "queue_timeouts"))),
+        ("tribelet_hedger_total", "counter", "Hedged text completions: calls, hedges fired, won and skipped.",
+         counters(HEDGER.stats, "kind", ("calls", "hedged", "hedge_wins", "hedge_skipped"))),
+        ("tribelet_index_total", "counter", "User and team name index lookups and loads.",
+         [({"index": "users", "kind": key}, value) for key, value in USER_INDEX.stats.items()] +
+         [({"index": "team_names", "kind": key}, value) for key, value in TEAM_NAME_INDEX.stats.items()]),
+        ("tribelet_logo_jobs_total", "counter", "Background logo jobs by result.",
+         counters(LOGO_JOBS.stats, "result", ("submitted", "succeeded", "failed", "cancelled"))),
+        ("tribelet_smtp_total", "counter", "SMTP sessions opened, reused and dropped, and messages sent.",
+         counters(get_smtp_pool().stats, "kind", ("connects", "reuses", "health_check_failures", "reconnects", "messages"))),
+        ("tribelet_outbox_total", "counter", "Order emails queued, sent, retried, dead-lettered and replayed.",
+         counters(OUTBOX.stats, "kind", ("enqueued", "sent", "retried", "dead_lettered", "replayed"))),
+        ("tribelet_notification_digest_total", "counter", "Orders held for digests, large orders bypassing them, and digests sent.",
+         counters(DIGEST.stats, "kind", ("orders", "bypassed", "digests"))),
+        ("tribelet_logo_jobs_queued", "gauge", "Logo jobs waiting for a worker.", [({}, LOGO_JOBS.depth())]),
+        ("tribelet_event_loop_lag_seconds", "gauge", "Recent event loop lag.",
+         [({"quantile": q}, lag[min(len(lag) - 1, int(float(q) * len(lag)))]) for q in ("0.5", "0.99")] if lag else []),
+    ]
+
+metrics.register_collector(collect_service_stats)
+
+# Prometheus scrape endpoint (per worker process):
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Endpoint to generate the team name options:
 @app.post("/api/generate-names")
 def generate_names(data: Prompt):
@@ -127,11 +346,8 @@ def generate_names(data: Prompt):
     # Save to AWS:
     save_prompt_to_s3(data.prompt)
 
-    # Generate the single name:
-    single_name = generate_single_team_name(data.prompt)
-
-    # Generate multiple team name options:
-    team_names = generate_team_name(team_name=single_name, prompt=data.prompt)
+    # Generate the headline name and alternatives in one structured call:
+    team_names = generate_team_names(data.prompt)
 
     # Return OpenAI outputs:
     return {"team_names": team_names}
@@ -154,13 +370,73 @@ def generate_summary_route(data: Prompt):
     # Return summary:
     return {"summary": summary}
 
+# Streaming endpoint for the team summary:
+@app.post("/api/generate-summary/stream")
+def generate_summary_stream(data: Prompt):
+    """
+    Streams the team pitch as Server-Sent Events.
+
+    Events: "token" {"text": ...} per delta, then "done" {"summary": ...}
+    (or "error" {"error": ...}).
+    """
+    def events():
+        parts = []
+        try:
+            for delta in stream_summary(data.prompt):
+                parts.append(delta)
+                yield sse("token", {"text": delta})
+            yield sse("done", {"summary": "".join(parts).strip()})
+        except Exception as e:
+            print(f"Summary stream error: {e}")
+            yield sse("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# Streaming endpoint for the team names:
+@app.post("/api/generate-names/stream")
+def generate_names_stream(data: Prompt):
+    """
+    Streams team names as Server-Sent Events.
+
+    Events: "token" {"text": ...} per delta, "name" {"name": ...} as each
+    numbered line completes, then "done" {"team_names": [...]} (or "error").
+    """
+    # Save to AWS (buffered):
+    save_prompt_to_s3(data.prompt)
+
+    def events():
+        text = ""
+        sent = 0
+        try:
+            for delta in stream_team_names(data.prompt):
+                text += delta
+                yield sse("token", {"text": delta})
+
+                # Every line but the last is complete:
+                complete = split_numbered_names("\n".join(text.split("\n")[:-1]))
+                for name in complete[sent:]:
+                    yield sse("name", {"name": name})
+                sent = max(sent, len(complete))
+
+            team_names = split_numbered_names(text)
+            for name in team_names[sent:]:
+                yield sse("name", {"name": name})
+            yield sse("done", {"team_names": team_names})
+        except Exception as e:
+            print(f"Names stream error: {e}")
+            yield sse("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 # Endpoint to generate multiple team logos with GPT-4o:
 @app.post("/api/generate-logo")
 async def generate_logo(request: Request):
     """
     Generates multiple logo options for team logos using GPT-4o.
     Expects JSON body: { "prompt": "...", "team_name": "...", "count": 3 }
-    Returns: { "summary": ..., "logo_images": [...] }
+    Returns: { "summary": ..., "logos": [{"logo_id": ..., "preview_url": ...}], "count": ... }
+
+    Images are staged server-side; pass the chosen logo_id to /api/save-team.
     """
     from fastapi import Request
     from fastapi.responses import JSONResponse
@@ -181,15 +457,20 @@ async def generate_logo(request: Request):
         count = 3  # Default fallback
 
     try:
-        short_summary = generate_short_summary(prompt)
-        logo_images = generate_logo_image(prompt=short_summary, team_name=team_name, count=count)
+        short_summary = await run_in_threadpool(generate_short_summary, prompt)
+        logo_images = await run_in_threadpool(generate_logo_image, prompt=short_summary, team_name=team_name, count=count)
+
+        # Stage the images and only send IDs + preview URLs back:
+        logos = await asyncio.gather(*[stage_logo(base64.b64decode(image)) for image in logo_images])
         
         return {
             "summary": short_summary,
-            "logo_images": logo_images,
-            "count": len(logo_images)  # Return actual count generated
+            "logos": logos,
+            "count": len(logos)  # Return actual count generated
         }
-        
+
+    except (OpenAIRateLimited, OpenAIUnavailable, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"Logo generation error: {e}")
         return JSONResponse(
@@ -197,6 +478,186 @@ async def generate_logo(request: Request):
             content={"error": f"Logo generation failed: {str(e)}"}
         )
 
+# Streaming endpoint for logo generation:
+@app.post("/api/generate-logo/stream")
+async def generate_logo_stream(data: LogoRequest):
+    """
+    Streams logo generation progress as Server-Sent Events.
+
+    Events: "summary" {"summary": ...}; "partial_image" {"index", "partial_image_index", "b64"}
+    while an image renders; "logo" {"index", "logo_id", "preview_url"} as each image is
+    staged; "error" {"index", "error"} per failed image; then "done" {"count": ...}.
+    """
+    count = data.count if 1 <= data.count <= 5 else 3
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    # Called from the generation threads:
+    def on_event(kind, payload):
+        loop.call_soon_threadsafe(queue.put_nowait, (kind, payload))
+
+    async def events():
+        try:
+            short_summary = await run_in_threadpool(generate_short_summary, data.prompt)
+            yield sse("summary", {"summary": short_summary})
+
+            generation = asyncio.ensure_future(
+                run_in_threadpool(stream_logo_images, short_summary, data.team_name, count, on_event)
+            )
+            generation.add_done_callback(lambda _: queue.put_nowait(("end", None)))
+
+            staged = 0
+            while True:
+                kind, payload = await queue.get()
+                if kind == "end":
+                    break
+                if kind == "image":
+                    logo = await stage_logo(base64.b64decode(payload["b64"]))
+                    staged += 1
+                    yield sse("logo", {"index": payload["index"], **logo})
+                else:
+                    yield sse(kind, payload)
+
+            generation.result()
+            yield sse("done", {"count": staged})
+        except Exception as e:
+            print(f"Logo stream error: {e}")
+            yield sse("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# --- Background logo jobs ---
+
+# Job record as returned to the browser:
+def logo_job_view(record: dict) -> dict:
+    view = {key: record.get(key) for key in ("job_id", "status", "count", "created_at", "started_at", "finished_at", "expires_at", "error")}
+    view["status_url"] = f"/api/logo-jobs/{record['job_id']}"
+    view["result_url"] = f"/api/logo-jobs/{record['job_id']}/result"
+    return view
+
+# Submit logo generation as a background job:
+@app.post("/api/logo-jobs", status_code=202)
+async def submit_logo_job(data: LogoJobRequest):
+    """
+    Queues logo generation and returns immediately.
+    Poll status_url, then fetch result_url once the status is "succeeded".
+
+    Returns: { "job_id": ..., "status": "queued", "status_url": ..., "result_url": ..., ... }
+    """
+    count = data.count if 1 <= data.count <= 5 else 3
+    try:
+        record = await LOGO_JOBS.submit(data.prompt, data.team_name, count)
+    except JobQueueFull as e:
+        print(f"Logo job rejected: {e}")
+        raise HTTPException(status_code=429, detail="Too many logo jobs queued, please try again shortly.")
+    return logo_job_view(record)
+
+# Logo job status:
+@app.get("/api/logo-jobs/{job_id}")
+async def get_logo_job(job_id: str):
+    record = await run_storage(read_logo_job, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Logo job not found")
+    return logo_job_view(record)
+
+# Logo job result:
+@app.get("/api/logo-jobs/{job_id}/result")
+async def get_logo_job_result(job_id: str):
+    """
+    Returns: { "summary": ..., "logos": [{"logo_id": ..., "preview_url": ...}], "count": ... }
+    once the job succeeded; 202 with the job status while it is still pending;
+    410 if it was cancelled or has expired; 500 if it failed.
+    """
+    record = await run_storage(read_logo_job, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Logo job not found")
+
+    if record["status"] == SUCCEEDED:
+        return {"summary": record["summary"], "logos": record["logos"], "count": len(record["logos"])}
+    if record["status"] in PENDING:
+        return JSONResponse(status_code=202, content=logo_job_view(record))
+    if record["status"] == FAILED:
+        return JSONResponse(status_code=500, content={"error": f"Logo generation failed: {record['error']}"})
+    raise HTTPException(status_code=410, detail=f"Logo job {record['status']}")
+
+# Cancel a logo job:
+@app.delete("/api/logo-jobs/{job_id}")
+async def cancel_logo_job(job_id: str):
+    record = await LOGO_JOBS.cancel(job_id)
+    if record is not None:
+        return logo_job_view(record)
+
+    current = await run_storage(read_logo_job, job_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Logo job not found")
+    raise HTTPException(status_code=409, detail=f"Logo job already {current['status']}")
+
+# Endpoint to generate the whole team identity in one go:
+@app.post("/api/generate-all")
+async def generate_all(data: GenerateAllRequest):
+    """
+    Generates names, pitch, short summary and logos from one prompt.
+
+    The steps run as a dependency-aware pipeline: names, pitch and short
+    summary start together, and logo generation starts as soon as the
+    headline name and short summary exist (without waiting for the pitch).
+
+    Returns: { "team_names": [...], "summary": ..., "short_summary": ...,
+               "logos": [{"logo_id": ..., "preview_url": ...}], "count": ..., "timings": {...} }
+    """
+    from fastapi.responses import JSONResponse
+
+    count = data.count if 1 <= data.count <= 5 else 3
+    started = time.perf_counter()
+    timings = {}
+
+    async def timed(step, func, *args, **kwargs):
+        result = await run_in_threadpool(func, *args, **kwargs)
+        timings[step] = round(time.perf_counter() - started, 3)
+        return result
+
+    async def logos_after(names_task, short_summary_task):
+        team_names, short_summary = await asyncio.gather(names_task, short_summary_task)
+        if not team_names:
+            raise Exception(f"Name generation failed: {team_names}")
+        logo_images = await timed("logos", generate_logo_image, prompt=short_summary, team_name=team_names[0], count=count)
+        logos = await asyncio.gather(*[stage_logo(base64.b64decode(image)) for image in logo_images])
+        timings["staged"] = round(time.perf_counter() - started, 3)
+        return logos
+
+    # Save to AWS (buffered):
+    save_prompt_to_s3(data.prompt)
+
+    names_task = asyncio.create_task(timed("names", generate_team_names, data.prompt))
+    short_summary_task = asyncio.create_task(timed("short_summary", generate_short_summary, data.prompt))
+    summary_task = asyncio.create_task(timed("summary", generate_summary, data.prompt))
+    logos_task = asyncio.create_task(logos_after(names_task, short_summary_task))
+
+    try:
+        team_names, summary, short_summary, logos = await asyncio.gather(
+            names_task, summary_task, short_summary_task, logos_task
+        )
+    except Exception as e:
+        for task in (names_task, summary_task, short_summary_task, logos_task):
+            task.cancel()
+        if isinstance(e, (OpenAIRateLimited, OpenAIUnavailable, DeadlineExceeded)):
+            raise
+        print(f"Identity generation error: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Identity generation failed: {str(e)}"}
+        )
+
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return {
+        "team_names": team_names,
+        "summary": summary,
+        "short_summary": short_summary,
+        "logos": logos,
+        "count": len(logos),
+        "timings": timings
+    }
+
 # Updated save-team endpoint
 @app.post("/api/save-team")
 async def save_team(request: Request):
@@ -213,7 +674,8 @@ async def save_team(request: Request):
         # Extract required fields
         team_name = data.get("team_name")
         summary = data.get("summary", "")
-        logo_url = data.get("logo_url")  # This will be base64 data
+        logo_id = data.get("logo_id")  # Staged logo from /api/generate-logo
+        logo_url = data.get("logo_url")  # Legacy: base64 data
         username = data.get("username")
         email = data.get("email")
         password = data.get("password")
@@ -226,7 +688,7 @@ async def save_team(request: Request):
             )
         
         # Check if user already exists, if not create them
-        existing_user = get_user_by_credentials(email, password)
+        existing_user = await run_storage(get_user_by_credentials, email, password)
         if not existing_user:
             # Create new user
             user_data = {
@@ -234,7 +696,7 @@ async def save_team(request: Request):
                 "email": email,
                 "password": password
             }
-            save_user_to_s3(user_data)
+            await run_storage(save_user_to_s3, user_data)
             print(f"Created new user: {username}")
         else:
             print(f"Using existing user: {existing_user['username']}")
@@ -242,30 +704,37 @@ async def save_team(request: Request):
         # Generate team ID
         team_id = str(uuid.uuid4())
         
-        # Handle logo: convert base64 to S3 URL
+        # Handle logo: convert base64 to a shared, content-addressed S3 URL
         s3_logo_url = ""
-        if logo_url:
+        logo_variants = {}
+        if logo_id or logo_url:
             try:
-                # Save base64 logo directly to S3
-                s3_logo_url = upload_logo_from_base64(logo_url, team_id)
+                if logo_id:
+                    # Promote the staged logo and its variants with server-side copies
+                    s3_logo_url, logo_variants = await promote_staged_logo(logo_id)
+                else:
+                    # Save base64 logo to S3 with its optimised, pre-sized variants
+                    s3_logo_url, logo_variants = await store_logo_with_variants(base64.b64decode(logo_url))
                 print(f"Uploaded logo to S3: {s3_logo_url}")
             except Exception as logo_error:
                 print(f"Logo upload failed: {logo_error}")
                 # Continue without logo rather than failing completely
                 s3_logo_url = ""
+                logo_variants = {}
         
         # Prepare team data
         team_dict = {
             "team_name": team_name,
             "summary": summary,
             "logo_url": s3_logo_url,
+            "logo_variants": logo_variants,
             "email": email,
             "team_id": team_id,
             "team_lead": username
         }
         
         # Save team to S3
-        save_team_to_s3(team_dict)
+        await run_storage(save_team_to_s3, team_dict)
         print(f"Saved team: {team_name}")
         
         return {
@@ -287,30 +756,30 @@ async def save_team(request: Request):
 
 # Endpoint to load existing teams:
 @app.get("/api/teams/by-user")
-def get_teams_by_user(email: str = Query(...)):
-    return {"teams": get_teams_by_email(email)}
+async def get_teams_by_user(email: str = Query(...)):
+    return {"teams": await run_storage(get_teams_by_email, email)}
 
 # Function to check whether a team name exists:
 @app.get("/api/check-team-name")
-def check_team_name(name: str = Query(...)):
-    exists = check_team_name_in_s3(name)
+async def check_team_name(name: str = Query(...)):
+    exists = await run_storage(check_team_name_in_s3, name)
     return {"exists": exists}
 
 # --- User Functions ---
 
 # Endpoint to create account:
 @app.post("/api/create-account")
-def create_account(data: AuthRequest):
+async def create_account(data: AuthRequest):
     if not data.username:
         raise HTTPException(status_code=400, detail="Username is required for account creation")
     
-    save_user_to_s3(data.dict())
+    await run_storage(save_user_to_s3, data.dict())
     return {"message": "Account created", "username": data.username}
 
 # Endpoint for login:
 @app.post("/api/login")
-def login(data: AuthRequest):
-    username = validate_user_login(data.email, data.password)
+async def login(data: AuthRequest):
+    username = await run_storage(validate_user_login, data.email, data.password)
     if username:
         return {"message": "Login successful", "username": username}
     raise HTTPException(status_code=401, detail="Invalid email or password")
@@ -320,42 +789,91 @@ def login(data: AuthRequest):
 # Add this endpoint to your API FUNCTIONS section:
 @app.post("/api/send-order-confirmation")
 async def send_order_confirmation(order_data: KitOrderRequest):
-    """Send order confirmation email and save order to S3"""
+    """Save order to S3 and queue the confirmation emails (delivered in the background)"""
+    saved = None
     try:
         # Convert Pydantic model to dict
         order_dict = order_data.dict()
         
         # Save order to S3 for record keeping
-        save_order_to_s3(order_dict)
-        
-        # Send confirmation email
-        email_sent = send_order_confirmation_email(order_dict)
-        
-        if email_sent:
+        saved = await run_storage(save_order_to_s3, order_dict)
+        if saved is False:
+            # A resubmitted order: its emails were queued the first time
             return {
-                "message": "Order confirmation sent successfully",
+                "message": "Order already received",
                 "order_id": order_data.order_id,
-                "email_sent": True
-            }
-        else:
-            return {
-                "message": "Order saved but email failed to send",
-                "order_id": order_data.order_id,
-                "email_sent": False
+                "email_queued": True
             }
+        
+        # Queue the emails in the outbox; no SMTP on the checkout path
+        await run_storage(queue_order_confirmation_email, order_dict)
+        
+        return {
+            "message": "Order received, confirmation email queued",
+            "order_id": order_data.order_id,
+            "email_queued": True
+        }
             
     except Exception as e:
         print(f"Error processing order: {str(e)}")
-        # Still try to save the order even if email fails
-        try:
-            save_order_to_s3(order_data.dict())
-        except:
-            pass
+        # Still try to save the order even if queueing the email fails
+        if saved is None:
+            try:
+                await run_storage(save_order_to_s3, order_data.dict())
+            except:
+                pass
         
         return {
             "message": "Order received but confirmation failed",
             "order_id": order_data.order_id,
-            "email_sent": False,
+            "email_queued": False,
             "error": str(e)
         }
 
+# --- Admin ---
+
+# Admin endpoints need the X-Admin-Token header to match ADMIN_TOKEN (disabled if unset):
+def require_admin(x_admin_token: str | None = Header(None)):
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# Inspect the email outbox:
+@app.get("/api/admin/outbox", dependencies=[Depends(require_admin)])
+async def list_outbox(state: str = Query("pending", pattern="^(pending|dead)$")):
+    messages = await run_storage(OUTBOX.list_messages, state)
+    return {"state": state, "count": len(messages), "messages": messages}
+
+# Replay one outbox message (dead-lettered or waiting on a retry):
+@app.post("/api/admin/outbox/{message_id}/replay", dependencies=[Depends(require_admin)])
+async def replay_outbox_message(message_id: str):
+    if not await run_storage(OUTBOX.replay, message_id):
+        raise HTTPException(status_code=404, detail="Outbox message not found")
+    return {"id": message_id, "replayed": True}
+
+# Replay every dead-lettered message:
+@app.post("/api/admin/outbox/replay-dead", dependencies=[Depends(require_admin)])
+async def replay_dead_outbox():
+    dead = await run_storage(OUTBOX.list_messages, "dead")
+    replayed = [message["id"] for message in dead if await run_storage(OUTBOX.replay, message["id"])]
+    return {"replayed": replayed, "count": len(replayed)}
+
+# Sales totals (units per size, and orders/units/revenue per day, kit type and team):
+@app.get("/api/admin/order-aggregates", dependencies=[Depends(require_admin)])
+async def get_order_aggregates():
+    return await run_storage(read_order_aggregates)
+
+# One stored order record:
+@app.get("/api/admin/orders/{order_id}", dependencies=[Depends(require_admin)])
+async def get_order(order_id: str):
+    record = await run_storage(read_order_record, order_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return record
+
+# Send the pending order digest now instead of waiting for the window:
+@app.post("/api/admin/outbox/flush-digest", dependencies=[Depends(require_admin)])
+async def flush_notification_digest():
+    orders = await run_storage(DIGEST.flush_due, True)
+    return {"orders": orders}
+
@@ -0,0 +1,165 @@
+# --- Maintenance commands ---
+# Usage: python manage.py <command>
+
+# Environment variables:
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import os
+import json
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from aws_s3 import s3, AWS_BUCKET, USER_LOG, TEAM_LOG, PROMPT_LOG_PREFIX, rebuild_team_email_index
+from email_utils import ORDER_LOG, ORDER_NOTIFICATIONS, build_order_confirmation_messages
+from email_templates import TEMPLATES, order_context
+from log_store import SegmentLog
+from s3_writes import update_object
+from prompt_log import convert_legacy_prompt_log
+from order_store import rebuild_order_aggregates
+
+# Rebuild the per-email team index from teams/team_log.csv and the team log segments:
+def rebuild_team_email_index_command(args):
+    count = rebuild_team_email_index()
+    print(f"Indexed teams for {count} email addresses")
+
+# Compact every append-only log now, ignoring the grace period if asked:
+def compact_logs_command(args):
+    for log in [USER_LOG, TEAM_LOG, ORDER_LOG]:
+        merged = log.compact(grace_seconds=args.grace) if args.grace is not None else log.compact()
+        print(f"{log.prefix}: merged {merged} segments")
+
+# Split the legacy prompt_log.json array into NDJSON segments:
+def convert_prompt_log_command(args):
+    count = convert_legacy_prompt_log(s3, AWS_BUCKET, PROMPT_LOG_PREFIX, chunk_size=args.chunk_size)
+    print(f"Converted {count} prompts into {PROMPT_LOG_PREFIX}")
+
+# Convert legacy CSV orders to JSON records and recompute the sales aggregates:
+def rebuild_order_aggregates_command(args):
+    converted, aggregated = rebuild_order_aggregates(ORDER_LOG)
+    print(f"Converted {converted} legacy orders, aggregated {aggregated} orders")
+
+# --- Concurrent writer stress check ---
+# Point AWS_ENDPOINT_URL at a local S3 stand-in (e.g. `moto_server`) to run it offline.
+
+STRESS_COLUMNS = ["timestamp", "writer", "sequence"]
+
+def _stress_log(prefix: str) -> SegmentLog:
+    return SegmentLog(s3, AWS_BUCKET, prefix, columns=STRESS_COLUMNS)
+
+def _stress_writer(prefix: str, writer: int, rows: int):
+    log = _stress_log(prefix)
+
+    def increment(current):
+        counter = json.loads(current) if current else {"count": 0}
+        counter["count"] += 1
+        return json.dumps(counter)
+
+    for sequence in range(rows):
+        log.append(["", writer, sequence])
+        update_object(s3, AWS_BUCKET, f"{prefix}/counter.json", increment)
+        if sequence % 10 == 0:
+            # Compactions race with each other and with the appends:
+            log.compact(grace_seconds=0)
+
+def stress_writes_command(args):
+    prefix = f"stress/{uuid.uuid4().hex[:8]}"
+    with ProcessPoolExecutor(max_workers=args.writers) as pool:
+        futures = [pool.submit(_stress_writer, prefix, writer, args.rows) for writer in range(args.writers)]
+        for future in futures:
+            future.result()
+
+    expected = args.writers * args.rows
+    log = _stress_log(prefix)
+    rows = {(row["writer"], row["sequence"]) for row in log.read_rows()}
+    counter = json.loads(s3.get_object(Bucket=AWS_BUCKET, Key=f"{prefix}/counter.json")["Body"].read())["count"]
+
+    print(f"{prefix}: {len(rows)}/{expected} log rows, counter {counter}/{expected}")
+    if len(rows) != expected or counter != expected:
+        raise SystemExit("Lost writes detected")
+    print("No lost writes")
+
+
+# --- Email rendering benchmark ---
+
+BENCH_ORDER = {
+    "order_id": "TRB-BENCH", "customer_email": "bench@example.com", "customer_name": "Bench Customer",
+    "kit_type": "Football Shirt", "team_name": "Bench United", "design_name": "Classic Stripes",
+    "teamwear_color": "#A461F9", "emblem_color": "#ffffff", "front_image": True, "back_image": False,
+    "back_print_enabled": True, "back_print_text": "<Captain> & Co", "back_print_position": 40,
+    "quantities": {"XS": 0, "S": 4, "M": 10, "L": 8, "XL": 3, "XXL": 1},
+    "subtotal": 650.0, "tax": 130.0, "total": 780.0,
+}
+
+def _time_per_order(func, orders: int) -> float:
+    started = time.perf_counter()
+    for _ in range(orders):
+        func()
+    return (time.perf_counter() - started) / orders * 1e6
+
+# Time each stage of rendering an order's emails (microseconds per order, no SMTP or S3):
+def bench_email_render_command(args):
+    os.environ.setdefault("SENDER_EMAIL", "shop@example.com")
+    os.environ.setdefault("SMTP_USE_TLS", "0")
+    context = order_context(BENCH_ORDER)
+
+    def render_bodies():
+        for text, html in TEMPLATES.values():
+            text.render(context)
+            html.render(context)
+
+    def serialize():
+        for message in build_order_confirmation_messages(BENCH_ORDER):
+            message.as_string()
+
+    stages = [
+        ("context", lambda: order_context(BENCH_ORDER)),
+        ("bodies", render_bodies),
+        ("messages", lambda: build_order_confirmation_messages(BENCH_ORDER)),
+        ("messages+serialize", serialize),
+    ]
+    print(f"{args.orders} orders, {len(ORDER_NOTIFICATIONS)} emails each")
+    for name, func in stages:
+        func()
+        print(f"{name:>20}: {_time_per_order(func, args.orders):8.1f} us/order")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tribelet backend maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "rebuild-team-email-index",
+        help="Backfill teams/by_email/ from the team log"
+    ).set_defaults(func=rebuild_team_email_index_command)
+
+    compact = commands.add_parser("compact-logs", help="Merge log segments into compacted files")
+    compact.add_argument("--grace", type=int, default=None, help="Only merge segments older than this (seconds)")
+    compact.set_defaults(func=compact_logs_command)
+
+    convert = commands.add_parser("convert-prompt-log", help="Split prompt_log.json into NDJSON segments")
+    convert.add_argument("--chunk-size", type=int, default=1000, help="Prompts per segment")
+    convert.set_defaults(func=convert_prompt_log_command)
+
+    commands.add_parser(
+        "rebuild-order-aggregates",
+        help="Backfill orders/records/ from the order log and recompute orders/aggregates.json"
+    ).set_defaults(func=rebuild_order_aggregates_command)
+
+    stress = commands.add_parser("stress-writes", help="Check concurrent writers lose no rows")
+    stress.add_argument("--writers", type=int, default=8)
+    stress.add_argument("--rows", type=int, default=25)
+    stress.set_defaults(func=stress_writes_command)
+
+    bench = commands.add_parser("bench-email-render", help="Time order email rendering")
+    bench.add_argument("--orders", type=int, default=2000)
+    bench.set_defaults(func=bench_email_render_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+from datetime import datetime
+
+from s3_writes import put_if_absent, put_if_match, update_object
+from s3_objects import time_key, parse_time_key, list_keys
+from email_templates import digest_context, render_notifications
+
+# Send internal order notifications as a digest instead of two emails per order:
+NOTIFICATION_DIGEST = os.getenv("NOTIFICATION_DIGEST", "0") == "1"
+# A digest goes out once its oldest order has waited this long (seconds)...
+NOTIFICATION_DIGEST_WINDOW = float(os.getenv("NOTIFICATION_DIGEST_WINDOW", "900"))
+# ...or as soon as this many orders are waiting:
+NOTIFICATION_DIGEST_MAX_ORDERS = int(os.getenv("NOTIFICATION_DIGEST_MAX_ORDERS", "25"))
+# Orders this big (items or total) skip the digest and alert ops straight away:
+NOTIFICATION_DIGEST_BYPASS_ITEMS = int(os.getenv("NOTIFICATION_DIGEST_BYPASS_ITEMS", "50"))
+NOTIFICATION_DIGEST_BYPASS_TOTAL = float(os.getenv("NOTIFICATION_DIGEST_BYPASS_TOTAL", "1000"))
+NOTIFICATION_DIGEST_POLL_INTERVAL = float(os.getenv("NOTIFICATION_DIGEST_POLL_INTERVAL", "30"))
+
+# Waiting orders, and the lease that lets one worker at a time build a digest:
+DIGEST_PREFIX = "outbox/digest/"
+DIGEST_LEASE_KEY = "outbox/digest-lease.json"
+DIGEST_LEASE = 120
+
+DIGEST_NOTIFICATIONS = ["order_digest", "order_digest_business_copy"]
+
+
+class NotificationDigest:
+    """
+    Batches internal order notifications into one summary email.
+
+    `add` stores an order under the digest prefix (one small object, so
+    concurrent checkouts never contend). A background thread checks the
+    waiting orders and, when the oldest has waited NOTIFICATION_DIGEST_WINDOW
+    or NOTIFICATION_DIGEST_MAX_ORDERS are waiting, renders one digest and
+    hands it to the outbox, then deletes the orders it covered. Only the
+    worker holding the lease builds a digest, so orders aren't sent twice.
+    """
+
+    def __init__(self, client, bucket: str, outbox, enabled: bool = NOTIFICATION_DIGEST,
+                 window: float = NOTIFICATION_DIGEST_WINDOW, max_orders: int = NOTIFICATION_DIGEST_MAX_ORDERS):
+        self.client = client
+        self.bucket = bucket
+        self.outbox = outbox
+        self.enabled = enabled
+        self.window = window
+        self.max_orders = max_orders
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"orders": 0, "bypassed": 0, "digests": 0}
+
+    def accepts(self, order_data: dict) -> bool:
+        """Whether this order's internal notifications should wait for a digest."""
+        if not self.enabled:
+            return False
+        items = sum(qty for qty in order_data['quantities'].values() if qty > 0)
+        if items >= NOTIFICATION_DIGEST_BYPASS_ITEMS or order_data['total'] >= NOTIFICATION_DIGEST_BYPASS_TOTAL:
+            self.stats["bypassed"] += 1
+            return False
+        return True
+
+    def add(self, entry: dict) -> str:
+        """Queue one order (see email_templates.digest_entry) for the next digest."""
+        # Time-ordered IDs, so listing the prefix gives arrival order:
+        entry_id = f"{time_key()}-{uuid.uuid4().hex[:12]}"
+        put_if_absent(
+            self.client, self.bucket, f"{DIGEST_PREFIX}{entry_id}.json",
+            json.dumps(entry).encode("utf-8"), ContentType="application/json"
+        )
+        self.stats["orders"] += 1
+        self._wake.set()
+        return entry_id
+
+    def _list(self) -> list[str]:
+        return list_keys(self.client, self.bucket, DIGEST_PREFIX)
+
+    def _due(self, keys: list[str]) -> bool:
+        if len(keys) >= self.max_orders:
+            return True
+        # The oldest entry's ID starts with the time it was added:
+        queued_at = parse_time_key(keys[0][len(DIGEST_PREFIX):].split("-")[0])
+        return (datetime.utcnow() - queued_at).total_seconds() >= self.window
+
+    def _read(self, key: str) -> dict | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read().decode("utf-8"))
+
+    def _take_lease(self, until: float) -> str | None:
+        """Take the digest lease if it is free; returns the owner token that releases it."""
+        token = uuid.uuid4().hex
+        now = time.time()
+
+        def mutate(current):
+            lease = json.loads(current) if current else {"until": 0}
+            if lease["until"] > now:
+                return None
+            return json.dumps({"until": until, "owner": token}).encode("utf-8")
+
+        if update_object(self.client, self.bucket, DIGEST_LEASE_KEY, mutate, ContentType="application/json") is None:
+            return None
+        return token
+
+    def _release_lease(self, token: str):
+        # Only while we still hold it: if it expired, another worker may own it now.
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=DIGEST_LEASE_KEY)
+        except self.client.exceptions.NoSuchKey:
+            return
+        if json.loads(response["Body"].read().decode("utf-8")).get("owner") != token:
+            return
+        put_if_match(
+            self.client, self.bucket, DIGEST_LEASE_KEY, json.dumps({"until": 0}).encode("utf-8"),
+            response["ETag"], ContentType="application/json"
+        )
+
+    def flush_due(self, force: bool = False) -> int:
+        """
+        Send a digest of the waiting orders if the window or order count is
+        reached (or `force` is set).
+
+        Returns:
+            int: Number of orders covered by digests sent
+        """
+        keys = self._list()
+        if not keys or not (force or self._due(keys)):
+            return 0
+        until = time.time() + DIGEST_LEASE
+        token = self._take_lease(until)
+        if token is None:
+            return 0
+
+        flushed = 0
+        try:
+            # Re-list under the lease: another worker may have just flushed.
+            keys = self._list()
+            # Stop once the lease runs out, so its next holder can't send the same orders:
+            while keys and (force or self._due(keys)) and time.time() < until:
+                batch = keys[:self.max_orders]
+                entries = [entry for entry in (self._read(key) for key in batch) if entry is not None]
+                if not entries:
+                    break
+                sender = os.getenv("SENDER_EMAIL")
+                messages = render_notifications(DIGEST_NOTIFICATIONS, digest_context(entries), sender)
+                self.outbox.enqueue(messages, order_id=f"digest:{len(entries)}")
+                for key in batch:
+                    self.client.delete_object(Bucket=self.bucket, Key=key)
+
+                flushed += len(entries)
+                self.stats["digests"] += 1
+                keys = keys[len(batch):]
+        finally:
+            self._release_lease(token)
+        return flushed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(min(NOTIFICATION_DIGEST_POLL_INTERVAL, self.window))
+            self._wake.clear()
+            try:
+                self.flush_due()
+            except Exception as e:
+                print(f"Digest flush failed: {e}")
+
+    def _drain(self):
+        try:
+            self.flush_due(force=True)
+        except Exception as e:
+            print(f"Digest flush failed: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if not self.enabled:
+            # Digest mode was switched off: send whatever was still waiting,
+            # in the background so startup doesn't wait on S3.
+            self._thread = threading.Thread(target=self._drain, name="notification-digest-drain", daemon=True)
+            self._thread.start()
+            return
+        self._thread = threading.Thread(target=self._run, name="notification-digest", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the digest thread (waiting orders stay queued for the next worker)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=NOTIFICATION_DIGEST_POLL_INTERVAL)
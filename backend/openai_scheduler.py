@@ -0,0 +1,274 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+
+from openai import RateLimitError, APIConnectionError, APITimeoutError, APIStatusError
+
+from deadlines import remaining, DeadlineExceeded
+from metrics import Counter, Histogram, TOKEN_BUCKETS
+
+# Budgets (per worker) and retry policy:
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "60"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+
+
+# Per-call instrumentation ("function" is the openai_utils helper making the call):
+OPENAI_CALLS = Counter(
+    "openai_calls_total", "OpenAI calls by final outcome, after retries.", ("function", "model", "outcome")
+)
+OPENAI_ATTEMPT_SECONDS = Histogram(
+    "openai_attempt_duration_seconds", "Latency of each OpenAI request attempt (time to response headers for streams).",
+    ("function", "model", "outcome")
+)
+OPENAI_QUEUE_SECONDS = Histogram(
+    "openai_queue_wait_seconds", "Time spent waiting for rate-limit budget before an attempt.", ("function",)
+)
+OPENAI_STREAM_SECONDS = Histogram(
+    "openai_stream_duration_seconds", "Total duration of streamed OpenAI calls, first attempt to last event.",
+    ("function", "model")
+)
+OPENAI_RETRIES = Counter("openai_retries_total", "OpenAI attempts retried, by reason.", ("function", "model", "reason"))
+OPENAI_TOKENS = Counter("openai_tokens_total", "Tokens reported in response.usage.", ("function", "model", "kind"))
+OPENAI_PROMPT_TOKENS = Histogram(
+    "openai_prompt_tokens", "Prompt (input) tokens per call.", ("function", "model"), buckets=TOKEN_BUCKETS
+)
+OPENAI_COMPLETION_TOKENS = Histogram(
+    "openai_completion_tokens", "Completion (output) tokens per call.", ("function", "model"), buckets=TOKEN_BUCKETS
+)
+
+def record_usage(function: str, model: str, usage):
+    """Record token counts from a chat (prompt/completion) or responses (input/output) usage object."""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "input_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(usage, "output_tokens", None)
+
+    if isinstance(prompt, int):
+        OPENAI_TOKENS.inc(prompt, function=function, model=model, kind="prompt")
+        OPENAI_PROMPT_TOKENS.observe(prompt, function=function, model=model)
+    if isinstance(completion, int):
+        OPENAI_TOKENS.inc(completion, function=function, model=model, kind="completion")
+        OPENAI_COMPLETION_TOKENS.observe(completion, function=function, model=model)
+
+
+class OpenAIRateLimited(Exception):
+    """Our budget or OpenAI's rate limit is exhausted; retry after `retry_after` seconds (maps to 429)."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OpenAIUnavailable(Exception):
+    """OpenAI kept failing (or our quota is gone) after every retry (maps to 503)."""
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Correct an estimate once real usage is known (may go negative).
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+class OpenAIScheduler:
+    """
+    Shared gate for every OpenAI call in this worker.
+
+    Callers queue in FIFO order and each one waits until both the request
+    bucket (requests per minute) and the token bucket (estimated tokens per
+    minute) can cover it. A 429 pauses the whole queue for the Retry-After
+    period; 429s and transient failures are retried with jittered
+    exponential backoff, then surface as OpenAIRateLimited / OpenAIUnavailable.
+    """
+
+    def __init__(self, requests_per_minute: int = OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE,
+                 max_retries: int = OPENAI_MAX_RETRIES,
+                 queue_timeout: float = OPENAI_QUEUE_TIMEOUT):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "queue_timeouts": 0}
+
+    def acquire(self, estimated_tokens: int, timeout: float | None = None):
+        """
+        Block until it's this caller's turn and the budgets allow the call.
+        Never waits past the current request deadline.
+        """
+        ticket = object()
+        timeout = self.queue_timeout if timeout is None else timeout
+        left = remaining()
+        bounded_by_deadline = left is not None and left < timeout
+        give_up_at = time.monotonic() + (left if bounded_by_deadline else timeout)
+
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._queue[0] is ticket:
+                        wait = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1),
+                            self.tokens.wait_time(estimated_tokens),
+                        )
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(estimated_tokens)
+                            return
+
+                    time_left = give_up_at - now
+                    if time_left <= 0:
+                        self.stats["queue_timeouts"] += 1
+                        if bounded_by_deadline:
+                            raise DeadlineExceeded("Request deadline exceeded waiting for OpenAI capacity")
+                        raise OpenAIRateLimited(
+                            "Timed out waiting for OpenAI capacity",
+                            retry_after=max(wait or 1.0, 1.0)
+                        )
+                    self._condition.wait(time_left if wait is None else min(wait, time_left))
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def call(self, func, estimated_tokens: int = 1000, timeout: float | None = None,
+             function: str = "unknown", model: str = "unknown"):
+        """
+        Run `func` (one OpenAI request) under the budgets, with retries.
+
+        If the result has `.usage`, its token counts are recorded and the
+        token bucket is corrected for the difference from the estimate.
+        Latency, retries and the outcome are recorded under `function`/`model`.
+        """
+        try:
+            result = self._call(func, estimated_tokens, timeout, function, model)
+        except OpenAIRateLimited:
+            OPENAI_CALLS.inc(function=function, model=model, outcome="rate_limited")
+            raise
+        except OpenAIUnavailable:
+            OPENAI_CALLS.inc(function=function, model=model, outcome="unavailable")
+            raise
+        except DeadlineExceeded:
+            OPENAI_CALLS.inc(function=function, model=model, outcome="deadline_exceeded")
+            raise
+        except Exception:
+            OPENAI_CALLS.inc(function=function, model=model, outcome="error")
+            raise
+        OPENAI_CALLS.inc(function=function, model=model, outcome="ok")
+        return result
+
+    def _call(self, func, estimated_tokens, timeout, function, model):
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            self.acquire(estimated_tokens, timeout=timeout)
+            started = time.perf_counter()
+            OPENAI_QUEUE_SECONDS.observe(started - queued, function=function)
+            self.stats["calls"] += 1
+            try:
+                result = func()
+            except RateLimitError as error:
+                OPENAI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, function=function, model=model, outcome="rate_limited")
+                self.stats["rate_limited"] += 1
+                if getattr(error, "code", None) == "insufficient_quota":
+                    raise OpenAIUnavailable("OpenAI quota exceeded") from error
+                delay = _retry_after(error) or self._backoff(attempt)
+                self.pause(delay)
+                if attempt == self.max_retries:
+                    raise OpenAIRateLimited("OpenAI rate limit exceeded", retry_after=delay) from error
+                OPENAI_RETRIES.inc(function=function, model=model, reason="rate_limited")
+            except Exception as error:
+                transient = _is_transient(error)
+                OPENAI_ATTEMPT_SECONDS.observe(
+                    time.perf_counter() - started, function=function, model=model,
+                    outcome="transient_error" if transient else "error"
+                )
+                if not transient:
+                    raise
+                if attempt == self.max_retries:
+                    raise OpenAIUnavailable(f"OpenAI unavailable: {error}") from error
+                delay = self._backoff(attempt)
+                left = remaining()
+                if left is not None and left < delay:
+                    raise DeadlineExceeded("Request deadline exceeded retrying OpenAI") from error
+                OPENAI_RETRIES.inc(function=function, model=model, reason="transient_error")
+                time.sleep(delay)
+            else:
+                OPENAI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, function=function, model=model, outcome="ok")
+                usage = getattr(result, "usage", None)
+                record_usage(function, model, usage)
+                total = getattr(usage, "total_tokens", None)
+                if isinstance(total, int):
+                    with self._condition:
+                        self.tokens.adjust(total - estimated_tokens)
+                return result
+            self.stats["retries"] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+
+# Rough token estimate for budget purposes (~4 characters per token):
+def estimate_tokens(messages: list[dict], max_tokens: int = 0) -> int:
+    return sum(len(message.get("content", "")) for message in messages) // 4 + max_tokens
@@ -1,142 +1,497 @@
 import os
-from openai import OpenAI, RateLimitError
+from openai import OpenAI
 import re
 import base64
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, ValidationError, field_validator
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from response_cache import ResponseCache, cache_key, make_persistent_tier
+from singleflight import SingleFlight
+from metrics import Histogram
+from openai_scheduler import (
+    OpenAIScheduler,
+    OpenAIRateLimited,
+    OpenAIUnavailable,
+    OPENAI_STREAM_SECONDS,
+    estimate_tokens,
+    record_usage
+)
+from deadlines import call_timeout, remaining, DeadlineExceeded, OPENAI_TIMEOUT, OPENAI_IMAGE_TIMEOUT
+from hedging import Hedger
+
+# Retries happen in SCHEDULER (budget- and deadline-aware), not in the client:
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Maximum image generation calls in flight per worker:
+LOGO_GENERATION_CONCURRENCY = int(os.getenv("LOGO_GENERATION_CONCURRENCY", "6"))
+_logo_executor = ThreadPoolExecutor(max_workers=LOGO_GENERATION_CONCURRENCY, thread_name_prefix="logo-gen")
+
+# Partial previews requested per streamed image (0-3):
+LOGO_PARTIAL_IMAGES = int(os.getenv("LOGO_PARTIAL_IMAGES", "2"))
+
+# Per-image generation time, reported on /metrics:
+LOGO_IMAGE_SECONDS = Histogram(
+    "logo_image_duration_seconds", "Time to generate each logo image, by outcome.", ("outcome",)
+)
+
+# Bump a helper's version whenever its prompt template changes (invalidates its cache entries):
+PROMPT_TEMPLATE_VERSIONS = {
+    "generate_summary": 1,
+    "generate_team_name": 1,
+    "generate_single_team_name": 1,
+    "generate_team_names": 1,
+    "generate_short_summary": 1,
+    "stream_team_names": 1,
+}
+
+# Cache for text completions (per-worker LRU + shared disk/S3 tier):
+RESPONSE_CACHE = ResponseCache(persistent=make_persistent_tier())
+
+# Identical requests already in flight share one upstream call:
+INFLIGHT = SingleFlight()
+
+# Every upstream call waits its turn here (RPM/TPM budgets, 429 backoff):
+SCHEDULER = OpenAIScheduler()
+
+# Budget charged per image call (image tokens aren't known up front):
+LOGO_ESTIMATED_TOKENS = int(os.getenv("LOGO_ESTIMATED_TOKENS", "2000"))
+
+# Short completions (max_tokens up to this) are hedged once they run past their p95:
+OPENAI_HEDGING = os.getenv("OPENAI_HEDGING", "1") == "1"
+HEDGE_MAX_TOKENS = int(os.getenv("HEDGE_MAX_TOKENS", "150"))
+HEDGER = Hedger()
+
+# Chat completion through the response cache:
+def _chat_completion(name: str, inputs: dict, messages: list[dict], model: str = "gpt-4.1-mini",
+                     use_cache: bool = True, **params) -> str:
+    """
+    Run a chat completion for helper `name` and return the message content.
+
+    Identical requests (same helper, template version, model, sampling
+    parameters and normalised inputs) are answered from RESPONSE_CACHE unless
+    `use_cache` is False, and concurrent ones are coalesced into one call.
+    Upstream calls go through SCHEDULER, so rate limits surface as
+    OpenAIRateLimited / OpenAIUnavailable. Each attempt gets the remaining
+    request budget as its timeout, and short completions are hedged.
+    """
+    key = cache_key(name, PROMPT_TEMPLATE_VERSIONS[name], model, params, inputs)
+
+    def attempt():
+        response = SCHEDULER.call(
+            lambda: client.chat.completions.create(
+                model=model, messages=messages, timeout=call_timeout(OPENAI_TIMEOUT), **params
+            ),
+            estimate_tokens(messages, params.get("max_tokens", 0)),
+            function=name,
+            model=model
+        )
+        return response.choices[0].message.content
+
+    def call():
+        if OPENAI_HEDGING and params.get("max_tokens", 0) <= HEDGE_MAX_TOKENS:
+            return HEDGER.call(name, attempt)
+        return attempt()
+
+    # Uncached callers only coalesce with each other, never with a cached call:
+    flight_key = key if use_cache else f"uncached:{key}"
+    return INFLIGHT.do(flight_key, lambda: RESPONSE_CACHE.get_or_call(key, call, use_cache=use_cache), timeout=remaining())
+
+# Streamed chat completion (yields content deltas), sharing the response cache:
+def _stream_chat_completion(name: str, inputs: dict, messages: list[dict], model: str = "gpt-4.1-mini",
+                            use_cache: bool = True, **params):
+    key = cache_key(name, PROMPT_TEMPLATE_VERSIONS[name], model, params, inputs)
+    if use_cache:
+        entry = RESPONSE_CACHE.get(key)
+        if entry is not None:
+            yield entry["value"]
+            return
+
+    started = time.perf_counter()
+    parts = []
+    # Rate limits are raised when the stream is opened, so only that is retried:
+    stream = SCHEDULER.call(
+        lambda: client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True},
+            timeout=call_timeout(OPENAI_TIMEOUT), **params
+        ),
+        estimate_tokens(messages, params.get("max_tokens", 0)),
+        function=name,
+        model=model
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+        # The final chunk carries the usage for the whole stream:
+        if getattr(chunk, "usage", None) is not None:
+            record_usage(name, model, chunk.usage)
+    OPENAI_STREAM_SECONDS.observe(time.perf_counter() - started, function=name, model=model)
+
+    if use_cache:
+        RESPONSE_CACHE.put(key, "".join(parts), time.perf_counter() - started)
+
+def _summary_messages(prompt: str) -> list[dict]:
+    return [
+        {"role": "system", "content": "You are a branding expert helping a small, non-professional sports team pitch for sponsorship on their kit."},
+        {"role": "user", "content": f"Create a 100-word team identity pitch for the following prompt: {prompt}. This should be aimed at securing a kit sponsor. Return only the pitch itself, do not keep the Open AI response. Do not include a title."}
+    ]
 
 # Client Pitch:
-def generate_summary(prompt: str) -> str:
+def generate_summary(prompt: str, use_cache: bool = True) -> str:
     """
     Function for generating a team summary based on the user's input prompt.
 
     Arguments:
     - prompt (string): A prompt provided by the user to describe their team.
+    - use_cache (bool): Set to False to bypass the response cache.
 
     Returns:
     - summary (string): A summary of the team in maximum 20 words from Open AI.
     """
 
     print("Sending prompt to Open AI... \n")
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a branding expert helping a small, non-professional sports team pitch for sponsorship on their kit."},
-                {"role": "user", "content": f"Create a 100-word team identity pitch for the following prompt: {prompt}. This should be aimed at securing a kit sponsor. Return only the pitch itself, do not keep the Open AI response. Do not include a title."}
-            ],
-            temperature=0.4,
-            max_tokens=500
-        )
+    content = _chat_completion(
+        "generate_summary",
+        {"prompt": prompt},
+        messages=_summary_messages(prompt),
+        use_cache=use_cache,
+        temperature=0.4,
+        max_tokens=500
+    )
+
+    summary = content.strip()
+    print("Received response:", summary, ".\n")
+    return summary
+
+# Client Pitch (streamed):
+def stream_summary(prompt: str, use_cache: bool = True):
+    """
+    Same pitch as generate_summary, yielded as text deltas as they arrive.
+    A cached pitch is yielded in one piece.
+    """
+    print("Streaming prompt to Open AI... \n")
+    yield from _stream_chat_completion(
+        "generate_summary",
+        {"prompt": prompt},
+        messages=_summary_messages(prompt),
+        use_cache=use_cache,
+        temperature=0.4,
+        max_tokens=500
+    )
+
+# Team Names (streamed as a numbered list):
+def stream_team_names(prompt: str, use_cache: bool = True):
+    """
+    Five team names as a numbered list, strongest first, yielded as text deltas.
+    Use split_numbered_names on the accumulated text to extract the names.
+    """
+    print("Streaming prompt to Open AI... \n")
+    yield from _stream_chat_completion(
+        "stream_team_names",
+        {"prompt": prompt},
+        messages=[
+            {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
+            {"role": "user", "content": f"Return a numbered list of five potential team names, based on this prompt: {prompt}. Put the strongest name first. Only return the list, one name per line, no other text."}
+        ],
+        use_cache=use_cache,
+        temperature=0.5,
+        max_tokens=100
+    )
 
-        summary = response.choices[0].message.content.strip()
-        print("Received response:", summary, ".\n")
-        return summary
-    except RateLimitError:
-        return "Error - OpenAI quota exceeded."
+# Extract team name items from a numbered list:
+def split_numbered_names(text: str) -> list[str]:
+    names = re.split(r"\d+\.\s*", text)  # Split on "1. ", "2. ", etc.
+    return [name.strip() for name in names if name.strip()]
 
 # Team Name:
-def generate_team_name(team_name: str, prompt: str) -> str:
+def generate_team_name(team_name: str, prompt: str, use_cache: bool = True) -> str:
     """
     Function for generating a team name based on the user's input prompt.
 
     Arguments:
     - prompt (string): A prompt provided by the user to describe their team.
+    - use_cache (bool): Set to False to bypass the response cache.
 
     Returns:
     - summary (string): A proposed team name.
     """
 
     print("Sending prompt to Open AI... \n")
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
-                {"role": "user", "content": f"Return a list of five potential team names, based on this prompt: {prompt}. Only return the list, no other text. The top of the five names should be {team_name} for reference."}
-            ],
-            temperature=0.5,
-            max_tokens=100
-        )
+    content = _chat_completion(
+        "generate_team_name",
+        {"prompt": prompt, "team_name": team_name},
+        messages=[
+            {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
+            {"role": "user", "content": f"Return a list of five potential team names, based on this prompt: {prompt}. Only return the list, no other text. The top of the five names should be {team_name} for reference."}
+        ],
+        use_cache=use_cache,
+        temperature=0.5,
+        max_tokens=100
+    )
 
-        summary = response.choices[0].message.content.strip()
-        print("Received response:", summary, ".\n")
+    summary = content.strip()
+    print("Received response:", summary, ".\n")
 
-        # Extract team name items:
-        names = re.split(r"\d+\.\s*", summary)  # Split on "1. ", "2. ", etc.
-        names = [name.strip() for name in names if name.strip()] 
+    # Extract team name items:
+    names = split_numbered_names(summary)
 
-        print(names[0])
-        return names
-    
-    except RateLimitError:
-        return "Error - OpenAI quota exceeded."
+    print(names[0])
+    return names
     
 # Single Team Name:
-def generate_single_team_name(prompt: str) -> str:
+def generate_single_team_name(prompt: str, use_cache: bool = True) -> str:
     """
     Function for generating a team name based on the user's input prompt.
 
     Arguments:
     - prompt (string): A prompt provided by the user to describe their team.
+    - use_cache (bool): Set to False to bypass the response cache.
 
     Returns:
     - summary (string): A proposed team name.
     """
 
     print("Sending prompt to Open AI... \n")
+    content = _chat_completion(
+        "generate_single_team_name",
+        {"prompt": prompt},
+        messages=[
+            {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
+            {"role": "user", "content": f"Return a single team name, based on this prompt: {prompt}. Only return the name, no other text or punctuation."}
+        ],
+        use_cache=use_cache,
+        temperature=0.5,
+        max_tokens=100
+    )
+
+    summary = content.strip()
+    print("Received response:", summary, ".\n")
+    return summary
+    
+# Structured name options (headline + alternatives in one call):
+class TeamNameOptions(BaseModel):
+    name: str
+    alternatives: list[str]
+
+    @field_validator("name")
+    @classmethod
+    def name_not_blank(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("name is empty")
+        return value
+
+    @field_validator("alternatives")
+    @classmethod
+    def clean_alternatives(cls, value: list[str]) -> list[str]:
+        names = [name.strip() for name in value if name.strip()]
+        if not names:
+            raise ValueError("no alternatives returned")
+        return names
+
+TEAM_NAME_SCHEMA = {
+    "name": "team_name_options",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string", "description": "The single best team name."},
+            "alternatives": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Four other team name options."
+            }
+        },
+        "required": ["name", "alternatives"],
+        "additionalProperties": False
+    }
+}
+
+# Team Names (single structured call):
+def generate_team_names(prompt: str, use_cache: bool = True) -> list[str]:
+    """
+    Function for generating the headline team name and alternatives in one call.
+
+    Uses JSON-schema structured output, validated with TeamNameOptions. Falls
+    back to generate_single_team_name + generate_team_name if the response
+    can't be parsed.
+
+    Arguments:
+    - prompt (string): A prompt provided by the user to describe their team.
+    - use_cache (bool): Set to False to bypass the response cache.
+
+    Returns:
+    - names (list): Five team names, the headline name first.
+    """
+
+    print("Sending prompt to Open AI... \n")
+    content = _chat_completion(
+        "generate_team_names",
+        {"prompt": prompt},
+        messages=[
+            {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
+            {"role": "user", "content": f"Suggest team names based on this prompt: {prompt}. Give the single best name, plus four other options. Names only, no numbering or punctuation."}
+        ],
+        use_cache=use_cache,
+        response_format={"type": "json_schema", "json_schema": TEAM_NAME_SCHEMA},
+        temperature=0.5,
+        max_tokens=150
+    )
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
-                {"role": "user", "content": f"Return a single team name, based on this prompt: {prompt}. Only return the name, no other text or punctuation."}
-            ],
-            temperature=0.5,
-            max_tokens=100
+        options = TeamNameOptions.model_validate_json(content)
+        print("Received response:", options, ".\n")
+
+        names = [options.name]
+        names.extend(name for name in options.alternatives if name not in names)
+        return names[:5]
+
+    except (ValidationError, ValueError, TypeError) as e:
+        print(f"Structured name output unusable ({e}), falling back to two-step generation")
+        return generate_team_name(
+            team_name=generate_single_team_name(prompt, use_cache=use_cache),
+            prompt=prompt,
+            use_cache=use_cache
         )
 
-        summary = response.choices[0].message.content.strip()
-        print("Received response:", summary, ".\n")
-        return summary
-    except RateLimitError:
-        return "Error - OpenAI quota exceeded."
-    
 # Short Summary for Logo Context:
-def generate_short_summary(prompt: str) -> str:
+def generate_short_summary(prompt: str, use_cache: bool = True) -> str:
     """
     Function for generating a short team summary for logo context.
 
     Arguments:
     - prompt (string): A prompt provided by the user to describe their team.
+    - use_cache (bool): Set to False to bypass the response cache.
 
     Returns:
     - summary (string): A 30-word team summary.
     """
 
     print("Sending prompt to Open AI... \n")
+    content = _chat_completion(
+        "generate_short_summary",
+        {"prompt": prompt},
+        messages=[
+            {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
+            {"role": "user", "content": f"Create a 30-word team identity summary for the following prompt: {prompt}."}
+        ],
+        use_cache=use_cache,
+        temperature=0.5,
+        max_tokens=100
+    )
+
+    summary = content.strip()
+    print("Received response:", summary, ".\n")
+    return summary
+
+# Generate a single logo image (one upstream call):
+def _generate_one_logo(full_prompt: str, index: int, count: int, on_event=None) -> list[str]:
+    """
+    Generate one logo. With `on_event(kind, payload)` the call is streamed and
+    reports "partial_image", "image" and "error" events as they happen.
+    """
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a branding expert helping people name new sports teams."},
-                {"role": "user", "content": f"Create a 30-word team identity summary for the following prompt: {prompt}."}
-            ],
-            temperature=0.5,
-            max_tokens=100
-        )
+        print(f"Generating logo {index+1}/{count} with GPT-4o...")
+
+        if on_event is None:
+            response = SCHEDULER.call(lambda: client.responses.create(
+                model="gpt-4o",
+                input=full_prompt,
+                tools=[{"type": "image_generation", "background": "transparent", "quality": "high"}],
+                timeout=call_timeout(OPENAI_IMAGE_TIMEOUT),
+            ), LOGO_ESTIMATED_TOKENS, function="generate_logo_image", model="gpt-4o")
+
+            # Extract base64 image(s) from the response
+            image_data = [
+                output.result
+                for output in response.output
+                if output.type == "image_generation_call"
+            ]
+        else:
+            image_data = []
+            stream = SCHEDULER.call(lambda: client.responses.create(
+                model="gpt-4o",
+                input=full_prompt,
+                tools=[{
+                    "type": "image_generation",
+                    "background": "transparent",
+                    "quality": "high",
+                    "partial_images": LOGO_PARTIAL_IMAGES
+                }],
+                stream=True,
+                timeout=call_timeout(OPENAI_IMAGE_TIMEOUT),
+            ), LOGO_ESTIMATED_TOKENS, function="stream_logo_images", model="gpt-4o")
+            for event in stream:
+                if event.type == "response.image_generation_call.partial_image":
+                    on_event("partial_image", {
+                        "index": index,
+                        "partial_image_index": getattr(event, "partial_image_index", 0),
+                        "b64": event.partial_image_b64
+                    })
+                elif event.type == "response.output_item.done" and event.item.type == "image_generation_call":
+                    image_data.append(event.item.result)
+                elif event.type == "response.completed":
+                    record_usage("stream_logo_images", "gpt-4o", getattr(event.response, "usage", None))
+            OPENAI_STREAM_SECONDS.observe(time.perf_counter() - started, function="stream_logo_images", model="gpt-4o")
+
+            for image in image_data:
+                on_event("image", {"index": index, "b64": image})
+
+        elapsed = time.perf_counter() - started
+        LOGO_IMAGE_SECONDS.observe(elapsed, outcome="ok" if image_data else "empty")
+
+        if image_data:
+            print(f"Successfully generated logo {index+1}/{count} in {elapsed:.1f}s")
+        else:
+            print(f"No image data received for logo {index+1}")
+        return image_data
+
+    except Exception as e:
+        # Keep going: the other images are still useful.
+        elapsed = time.perf_counter() - started
+        LOGO_IMAGE_SECONDS.observe(elapsed, outcome="error")
+        print(f"Error generating logo {index+1} with GPT-4o after {elapsed:.1f}s: {e}")
+        if on_event is not None:
+            on_event("error", {"index": index, "error": str(e)})
+        if isinstance(e, (OpenAIRateLimited, OpenAIUnavailable, DeadlineExceeded)):
+            raise
+        return []
+
+# Gather per-image results; rate limit and deadline errors only surface if every image failed:
+def _collect_logos(futures) -> list[str]:
+    logo_images, error = [], None
+    for future in futures:
+        try:
+            logo_images.extend(future.result())
+        except (OpenAIRateLimited, OpenAIUnavailable, DeadlineExceeded) as e:
+            error = error or e
+    if not logo_images and error is not None:
+        raise error
+    return logo_images
 
-        summary = response.choices[0].message.content.strip()
-        print("Received response:", summary, ".\n")
-        return summary
-    except RateLimitError:
-        return "Error - OpenAI quota exceeded."
+# Build the image prompt for a team:
+def _logo_prompt(prompt: str, team_name: str) -> str:
+    return (
+        f"Create a simple, transparent background, team coat of arms. "
+        f"DO NOT include text in the image, other than this explicit team name: '{team_name}'. "
+        f"The logo will go on the top right chest of a sports kit. "
+        f"The team has this description: '{prompt}'."
+    )
 
 # Logo Generation with GPT-4o (Multiple Images):
 def generate_logo_image(prompt: str, team_name: str, count: int = 3):
     """
     Generates multiple logo images using OpenAI's GPT-4o.
     Returns a list of base64-encoded PNG images.
+
+    The calls run concurrently (at most LOGO_GENERATION_CONCURRENCY per worker),
+    so wall-clock time is roughly that of the slowest image. Failed images are
+    skipped and the rest returned; per-image timings go to LOGO_IMAGE_SECONDS.
+    Identical requests made while one is in flight share its images.
     
     Args:
         prompt: Team description/context
@@ -146,42 +501,35 @@ def generate_logo_image(prompt: str, team_name: str, count: int = 3):
     Returns:
         List of base64-encoded image strings
     """
-    full_prompt = (
-        f"Create a simple, transparent background, team coat of arms. "
-        f"DO NOT include text in the image, other than this explicit team name: '{team_name}'. "
-        f"The logo will go on the top right chest of a sports kit. "
-        f"The team has this description: '{prompt}'."
-    )
+    full_prompt = _logo_prompt(prompt, team_name)
 
-    logo_images = []
-    
-    # Generate multiple images using GPT-4o (need multiple calls)
-    for i in range(count):
-        try:
-            print(f"Generating logo {i+1}/{count} with GPT-4o...")
-            
-            response = client.responses.create(
-                model="gpt-4o",
-                input=full_prompt,
-                tools=[{"type": "image_generation", "background": "transparent", "quality": "high"}],
-            )
+    def generate():
+        # Run the image calls concurrently (bounded by the shared logo pool):
+        futures = [
+            _logo_executor.submit(contextvars.copy_context().run, _generate_one_logo, full_prompt, i, count)
+            for i in range(count)
+        ]
 
-            # Extract base64 image(s) from the response
-            image_data = [
-                output.result
-                for output in response.output
-                if output.type == "image_generation_call"
-            ]
-            
-            if image_data:
-                logo_images.extend(image_data)
-                print(f"Successfully generated logo {i+1}/{count}")
-            else:
-                print(f"No image data received for logo {i+1}")
-            
-        except Exception as e:
-            print(f"Error generating logo {i+1} with GPT-4o: {e}")
-            continue
-
-    print(f"Generated {len(logo_images)} logos total")
-    return logo_images
\ No newline at end of file
+        logo_images = _collect_logos(futures)
+        print(f"Generated {len(logo_images)} logos total")
+        return logo_images
+
+    # A duplicate submit while the first is still generating waits for its images:
+    key = "logo:" + hashlib.sha256(f"{count}:{full_prompt}".encode("utf-8")).hexdigest()
+    return list(INFLIGHT.do(key, generate, timeout=remaining()))
+
+
+# Logo Generation with per-image progress events:
+def stream_logo_images(prompt: str, team_name: str, count: int, on_event) -> list[str]:
+    """
+    Like generate_logo_image, but calls `on_event(kind, payload)` from worker
+    threads as each image makes progress ("partial_image"), finishes ("image")
+    or fails ("error"). Blocks until every image is done.
+    """
+    full_prompt = _logo_prompt(prompt, team_name)
+    futures = [
+        _logo_executor.submit(contextvars.copy_context().run, _generate_one_logo, full_prompt, i, count, on_event)
+        for i in range(count)
+    ]
+
+    return _collect_logos(futures)
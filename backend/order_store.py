@@ -0,0 +1,281 @@
+import re
+import ast
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from aws_s3 import s3, AWS_BUCKET
+from s3_writes import put_if_absent, update_object
+from s3_objects import list_objects, list_keys, delete_keys
+
+# One JSON record per order, plus running sales totals:
+ORDER_RECORD_PREFIX = "orders/records/"
+ORDER_AGGREGATES_KEY = "orders/aggregates.json"
+# Orders not yet in the totals; the maintenance worker folds in any a save left behind:
+ORDER_AGGREGATES_PENDING_PREFIX = "orders/aggregates-pending/"
+# Folded markers are remembered this long (seconds) after they are gone, so a
+# worker that listed one just before its deletion can't fold it in again.
+# Markers whose order was never stored are dropped after this long too:
+ORDER_AGGREGATES_PENDING_GRACE = 3600
+
+ORDER_RECORD_VERSION = 1
+
+
+def order_record_key(order_id: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", order_id)
+    if safe != order_id:
+        # Keep IDs that only differ in unsafe characters apart:
+        safe = f"{safe}-{hashlib.sha256(order_id.encode()).hexdigest()[:8]}"
+    return f"{ORDER_RECORD_PREFIX}{safe}.json"
+
+def _pending_aggregates_key(order_id: str) -> str:
+    return ORDER_AGGREGATES_PENDING_PREFIX + order_record_key(order_id)[len(ORDER_RECORD_PREFIX):]
+
+
+def order_record(order_data: dict, created_at: str | None = None) -> dict:
+    """A typed, JSON-ready record of an order (sizes with zero quantity are dropped)."""
+    return {
+        "version": ORDER_RECORD_VERSION,
+        "order_id": order_data['order_id'],
+        "created_at": created_at or datetime.utcnow().isoformat(),
+        "customer": {"email": order_data['customer_email'], "name": order_data['customer_name']},
+        "team_name": order_data['team_name'],
+        "kit_type": order_data['kit_type'],
+        "design_name": order_data['design_name'],
+        "teamwear_color": order_data['teamwear_color'],
+        "emblem_color": order_data.get('emblem_color', ""),
+        "front_image": bool(order_data['front_image']),
+        "back_image": bool(order_data['back_image']),
+        "back_print": {
+            "enabled": bool(order_data.get('back_print_enabled', bool(order_data.get('back_print_text')))),
+            "text": order_data.get('back_print_text', ""),
+            "position": int(order_data.get('back_print_position', 50)),
+        },
+        "quantities": {str(size): int(qty) for size, qty in order_data['quantities'].items() if int(qty) > 0},
+        "subtotal": float(order_data.get('subtotal', 0)),
+        "tax": float(order_data.get('tax', 0)),
+        "total": float(order_data['total']),
+    }
+
+
+# --- Aggregates ---
+
+def _empty_aggregates() -> dict:
+    return {
+        "orders": 0, "units": 0, "revenue": 0.0,
+        "units_by_size": {}, "by_day": {}, "by_kit_type": {}, "by_team": {},
+        "updated_at": None, "pending_folded": {},
+    }
+
+def _add_totals(bucket: dict, units: int, revenue: float):
+    bucket["orders"] = bucket.get("orders", 0) + 1
+    bucket["units"] = bucket.get("units", 0) + units
+    bucket["revenue"] = round(bucket.get("revenue", 0.0) + revenue, 2)
+
+def add_to_aggregates(aggregates: dict, record: dict) -> dict:
+    """Fold one order record into the running totals (in place)."""
+    units = sum(record["quantities"].values())
+    _add_totals(aggregates, units, record["total"])
+    for size, qty in record["quantities"].items():
+        aggregates["units_by_size"][size] = aggregates["units_by_size"].get(size, 0) + qty
+    _add_totals(aggregates["by_day"].setdefault(record["created_at"][:10], {}), units, record["total"])
+    _add_totals(aggregates["by_kit_type"].setdefault(record["kit_type"], {}), units, record["total"])
+    _add_totals(aggregates["by_team"].setdefault(record["team_name"], {}), units, record["total"])
+    aggregates["updated_at"] = datetime.utcnow().isoformat()
+    return aggregates
+
+def _update_aggregates(records: list[dict]):
+    def merge(current):
+        aggregates = json.loads(current) if current else _empty_aggregates()
+        for record in records:
+            add_to_aggregates(aggregates, record)
+        return json.dumps(aggregates).encode("utf-8")
+
+    update_object(s3, AWS_BUCKET, ORDER_AGGREGATES_KEY, merge, ContentType="application/json")
+
+def _fold_pending(records: dict) -> int:
+    """
+    Add each marker's order (marker key -> record) to the aggregates, then
+    delete the markers.
+
+    The aggregates remember which markers they have folded in (until the
+    grace period after the marker is gone), so a crash between the update
+    and the delete, or two workers folding at once, can't count an order
+    twice.
+    """
+    folded = []
+
+    def merge(current):
+        aggregates = json.loads(current) if current else _empty_aggregates()
+        seen = aggregates.get("pending_folded", {})
+        if not records and not seen:
+            return None
+        now = time.time()
+        folded[:] = [key for key in records if key not in seen]
+        for key in folded:
+            add_to_aggregates(aggregates, records[key])
+        aggregates["pending_folded"] = {
+            key: folded_at for key, folded_at in seen.items()
+            if key in records or now - folded_at < ORDER_AGGREGATES_PENDING_GRACE
+        }
+        aggregates["pending_folded"].update((key, now) for key in folded)
+        return json.dumps(aggregates).encode("utf-8")
+
+    update_object(s3, AWS_BUCKET, ORDER_AGGREGATES_KEY, merge, ContentType="application/json")
+    delete_keys(s3, AWS_BUCKET, list(records))
+    return len(folded)
+
+# Finish the aggregate updates that saves left pending (a crash, timeout or failed update):
+def apply_pending_aggregates() -> int:
+    """
+    Fold the orders under the pending prefix into the aggregates.
+
+    A marker only counts if the stored order record is the one it was
+    written with; one left by a resubmitted order is dropped. A marker with
+    no record yet is left to its save until the grace period runs out.
+
+    Returns:
+        int: Number of orders folded in
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ORDER_AGGREGATES_PENDING_GRACE)
+    records = {}
+    stale = []
+    for item in list_objects(s3, AWS_BUCKET, ORDER_AGGREGATES_PENDING_PREFIX):
+        try:
+            response = s3.get_object(Bucket=AWS_BUCKET, Key=item["Key"])
+        except s3.exceptions.NoSuchKey:
+            continue
+        marker = json.loads(response["Body"].read().decode("utf-8"))
+        stored = read_order_record(marker["order_id"])
+        if stored is None:
+            if item["LastModified"] < cutoff:
+                stale.append(item["Key"])
+        elif stored["created_at"] != marker["created_at"]:
+            stale.append(item["Key"])
+        else:
+            records[item["Key"]] = marker
+    delete_keys(s3, AWS_BUCKET, stale)
+    return _fold_pending(records)
+
+
+# --- Reading and writing ---
+
+def save_order_record(order_data: dict) -> bool:
+    """
+    Store an order as a JSON record and add it to the aggregates.
+
+    The record is created with If-None-Match, so saving the same order
+    twice neither overwrites it nor counts it twice. A pending marker is
+    written before the record and deleted once the order is in the totals,
+    so a crash or a failed aggregate update only leaves it for
+    `apply_pending_aggregates` to fold in later; neither fails the save.
+
+    Returns:
+        bool: False if the order was already stored
+    """
+    record = order_record(order_data)
+    body = json.dumps(record).encode("utf-8")
+    marker_key = _pending_aggregates_key(record["order_id"])
+    try:
+        marked = put_if_absent(s3, AWS_BUCKET, marker_key, body, ContentType="application/json")
+    except Exception as e:
+        print(f"Failed to mark order aggregates pending for {record['order_id']}: {e}")
+        marked = False
+
+    if not put_if_absent(
+        s3, AWS_BUCKET, order_record_key(record["order_id"]), body, ContentType="application/json"
+    ):
+        if marked:
+            # Left behind, it is dropped by apply_pending_aggregates anyway:
+            try:
+                s3.delete_object(Bucket=AWS_BUCKET, Key=marker_key)
+            except Exception:
+                pass
+        return False
+
+    try:
+        if marked:
+            _fold_pending({marker_key: record})
+        else:
+            _update_aggregates([record])
+    except Exception as e:
+        print(f"Failed to update order aggregates for {record['order_id']}, will retry: {e}")
+        if not marked:
+            try:
+                s3.put_object(Bucket=AWS_BUCKET, Key=marker_key, Body=body, ContentType="application/json")
+            except Exception as e:
+                print(f"Order aggregates for {record['order_id']} need a rebuild: {e}")
+    return True
+
+def read_order_record(order_id: str) -> dict | None:
+    try:
+        response = s3.get_object(Bucket=AWS_BUCKET, Key=order_record_key(order_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+def read_order_aggregates() -> dict:
+    try:
+        response = s3.get_object(Bucket=AWS_BUCKET, Key=ORDER_AGGREGATES_KEY)
+    except s3.exceptions.NoSuchKey:
+        return _empty_aggregates()
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+# --- Backfill ---
+
+def _legacy_record(row: dict) -> dict:
+    # Old CSV rows store the quantity dict via str() and booleans as "True"/"False":
+    try:
+        quantities = ast.literal_eval(row.get("quantities") or "{}")
+    except (ValueError, SyntaxError):
+        quantities = {}
+    return order_record({
+        **row,
+        "quantities": quantities,
+        "front_image": row.get("front_image") == "True",
+        "back_image": row.get("back_image") == "True",
+        "back_print_position": row.get("back_print_position") or 50,
+        "total": row.get("total") or 0,
+    }, created_at=row.get("timestamp") or None)
+
+# Convert the legacy order log and recompute the aggregates from every record:
+def rebuild_order_aggregates(order_log) -> tuple[int, int]:
+    """
+    Write a JSON record for every order in `order_log` that lacks one, then
+    recompute the aggregates from all records.
+
+    Orders saved while this runs may be missed by the recomputed totals;
+    run it when traffic is quiet.
+
+    Returns:
+        tuple: (legacy orders converted, orders aggregated)
+    """
+    converted = 0
+    for row in order_log.read_rows():
+        if not row.get("order_id"):
+            continue
+        record = _legacy_record(row)
+        if put_if_absent(
+            s3, AWS_BUCKET, order_record_key(record["order_id"]),
+            json.dumps(record).encode("utf-8"), ContentType="application/json"
+        ):
+            converted += 1
+
+    # The recomputed totals cover every pending order listed before the records:
+    pending = list_keys(s3, AWS_BUCKET, ORDER_AGGREGATES_PENDING_PREFIX)
+    aggregates = _empty_aggregates()
+    records = []
+    for key in list_keys(s3, AWS_BUCKET, ORDER_RECORD_PREFIX):
+        response = s3.get_object(Bucket=AWS_BUCKET, Key=key)
+        records.append(json.loads(response["Body"].read().decode("utf-8")))
+    for record in sorted(records, key=lambda record: record["created_at"]):
+        add_to_aggregates(aggregates, record)
+
+    s3.put_object(
+        Bucket=AWS_BUCKET, Key=ORDER_AGGREGATES_KEY,
+        Body=json.dumps(aggregates).encode("utf-8"), ContentType="application/json"
+    )
+    delete_keys(s3, AWS_BUCKET, pending)
+    return converted, len(records)
@@ -0,0 +1,135 @@
+import os
+import gzip
+import json
+import uuid
+import atexit
+import threading
+from datetime import datetime
+
+from s3_writes import put_if_absent
+from s3_objects import time_key
+
+# Flush a segment once this many prompts are buffered, or this many seconds pass:
+PROMPT_LOG_FLUSH_SIZE = int(os.getenv("PROMPT_LOG_FLUSH_SIZE", "50"))
+PROMPT_LOG_FLUSH_INTERVAL = float(os.getenv("PROMPT_LOG_FLUSH_INTERVAL", "30"))
+PROMPT_LOG_GZIP = os.getenv("PROMPT_LOG_GZIP", "true").lower() == "true"
+
+
+# Encode entries as newline-delimited JSON, optionally gzipped:
+def encode_segment(entries: list[dict], compress: bool) -> bytes:
+    body = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+    return gzip.compress(body) if compress else body
+
+
+class PromptLogBuffer:
+    """
+    Write-behind buffer for prompt logging.
+
+    `add` only appends to an in-memory list. A background thread writes the
+    buffered prompts as one NDJSON segment under `prefix` whenever the buffer
+    reaches `flush_size` entries or `flush_interval` seconds pass, and `stop`
+    drains whatever is left on shutdown.
+    """
+
+    def __init__(self, client, bucket: str, prefix: str,
+                 flush_size: int = PROMPT_LOG_FLUSH_SIZE,
+                 flush_interval: float = PROMPT_LOG_FLUSH_INTERVAL,
+                 compress: bool = PROMPT_LOG_GZIP):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self._entries = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, entry: dict):
+        with self._lock:
+            self._entries.append(entry)
+            full = len(self._entries) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> str | None:
+        """
+        Write everything buffered so far as one segment.
+
+        Returns:
+            str | None: The segment key, or None if there was nothing to write
+        """
+        with self._lock:
+            entries, self._entries = self._entries, []
+        if not entries:
+            return None
+
+        key = f"{self.prefix}{time_key()}-{uuid.uuid4().hex[:12]}.jsonl" + (".gz" if self.compress else "")
+        try:
+            put_if_absent(
+                self.client, self.bucket, key, encode_segment(entries, self.compress),
+                ContentType="application/gzip" if self.compress else "application/x-ndjson"
+            )
+        except Exception as e:
+            # Put them back so the next flush retries:
+            print(f"Prompt log flush failed: {e}")
+            with self._lock:
+                self._entries = entries + self._entries
+            return None
+        return key
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="prompt-log-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush thread and drain the buffer."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+
+# Split the legacy single-array prompt log into NDJSON segments:
+def convert_legacy_prompt_log(client, bucket: str, prefix: str, legacy_key: str = "prompt_log.json",
+                              chunk_size: int = 1000, compress: bool = PROMPT_LOG_GZIP) -> int:
+    """
+    Convert `legacy_key` (a JSON array of prompts) into segments under `prefix`.
+
+    Segment keys are derived from each chunk's first timestamp and position,
+    so re-running the conversion never writes duplicates.
+
+    Returns:
+        int: Number of prompts converted
+    """
+    try:
+        response = client.get_object(Bucket=bucket, Key=legacy_key)
+    except client.exceptions.NoSuchKey:
+        return 0
+    logs = json.loads(response["Body"].read().decode("utf-8"))
+
+    for start in range(0, len(logs), chunk_size):
+        chunk = logs[start:start + chunk_size]
+        try:
+            stamp = time_key(datetime.fromisoformat(chunk[0]["timestamp"]))
+        except (KeyError, ValueError):
+            stamp = "00000000T000000000000Z"
+        key = f"{prefix}{stamp}-legacy{start // chunk_size:06d}.jsonl" + (".gz" if compress else "")
+        put_if_absent(
+            client, bucket, key, encode_segment(chunk, compress),
+            ContentType="application/gzip" if compress else "application/x-ndjson"
+        )
+
+    return len(logs)
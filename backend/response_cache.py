@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# In-memory tier:
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Persistent tier: "s3" (shared by every instance), "disk" (this host's workers only) or "none":
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "none")
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "/tmp/tribelet-response-cache")
+# The disk tier drops its least recently used entries past this size (checked every N writes):
+RESPONSE_CACHE_DIR_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_DIR_MAX_BYTES", str(256 * 1024 * 1024)))
+RESPONSE_CACHE_DIR_SWEEP_EVERY = int(os.getenv("RESPONSE_CACHE_DIR_SWEEP_EVERY", "100"))
+RESPONSE_CACHE_PERSISTENT_TTL = float(os.getenv("RESPONSE_CACHE_PERSISTENT_TTL", "86400"))
+
+
+# Normalise prompts so trivial edits (case, spacing) share an entry:
+def normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").split()).casefold()
+
+def cache_key(name: str, template_version: int, model: str, params: dict, inputs: dict) -> str:
+    """
+    Hash everything that determines a completion: the helper and its prompt
+    template version, the model, sampling parameters and normalised inputs.
+    """
+    material = {
+        "name": name,
+        "template_version": template_version,
+        "model": model,
+        "params": params,
+        "inputs": {key: normalize_prompt(value) for key, value in inputs.items()},
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# --- Persistent tiers ---
+
+class DiskTier:
+    def __init__(self, directory: str, max_bytes: int = RESPONSE_CACHE_DIR_MAX_BYTES,
+                 sweep_every: int = RESPONSE_CACHE_DIR_SWEEP_EVERY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sweep_every = sweep_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # The modification time doubles as "last used" for the sweep:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, entry: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so concurrent workers never read a partial file:
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """
+        Delete the least recently used entries until the directory fits in
+        `max_bytes`.
+
+        Returns:
+            int: Number of entries deleted
+        """
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        deleted = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        return deleted
+
+
+class S3Tier:
+    def __init__(self, client, bucket: str, prefix: str = "cache/openai/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key: str) -> dict | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+            return json.loads(response["Body"].read().decode("utf-8"))
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key: str, entry: dict):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json",
+            Body=json.dumps(entry),
+            ContentType="application/json"
+        )
+
+
+def make_persistent_tier(backend: str = RESPONSE_CACHE_BACKEND):
+    if backend == "disk":
+        return DiskTier(RESPONSE_CACHE_DIR)
+    if backend == "s3":
+        from aws_s3 import s3, AWS_BUCKET
+        return S3Tier(s3, AWS_BUCKET)
+    return None
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated text.
+
+    Tier 1 is a per-worker LRU with a TTL; tier 2 (S3, or disk for the
+    workers on one host) is shared between workers. Entries remember how long the original call took, so each
+    hit adds to `latency_saved_seconds`.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 persistent=None, persistent_ttl: float = RESPONSE_CACHE_PERSISTENT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.persistent_ttl = persistent_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "latency_saved_seconds": 0.0,
+        }
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                self.stats["latency_saved_seconds"] += cached[1]["elapsed"]
+                return cached[1]
+            if cached:
+                del self._entries[key]
+
+        if self.persistent is not None:
+            try:
+                entry = self.persistent.get(key)
+            except Exception as e:
+                print(f"Response cache read failed: {e}")
+                entry = None
+            if entry and entry["created_at"] + self.persistent_ttl > time.time():
+                self._remember(key, entry)
+                self.stats["persistent_hits"] += 1
+                self.stats["latency_saved_seconds"] += entry["elapsed"]
+                return entry
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value, elapsed: float):
+        entry = {"value": value, "elapsed": elapsed, "created_at": time.time()}
+        self._remember(key, entry)
+        if self.persistent is not None:
+            try:
+                self.persistent.put(key, entry)
+            except Exception as e:
+                print(f"Response cache write failed: {e}")
+
+    def get_or_call(self, key: str, call, use_cache: bool = True):
+        """
+        Return the cached value for `key`, or run `call()` and cache its result.
+
+        With `use_cache=False` the call always runs and nothing is stored.
+        """
+        if not use_cache:
+            return call()
+
+        entry = self.get(key)
+        if entry is not None:
+            return entry["value"]
+
+        started = time.perf_counter()
+        value = call()
+        self.put(key, value, time.perf_counter() - started)
+        return value
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+# UTC stamp used at the start of time-ordered keys, so listings sort in write order:
+KEY_TIME_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+# S3 accepts at most this many keys per DeleteObjects call:
+DELETE_BATCH_SIZE = 1000
+
+
+def time_key(moment: datetime | None = None) -> str:
+    return (moment or datetime.utcnow()).strftime(KEY_TIME_FORMAT)
+
+def parse_time_key(stamp: str) -> datetime:
+    return datetime.strptime(stamp, KEY_TIME_FORMAT)
+
+
+def list_objects(client, bucket: str, prefix: str, start_after: str = "") -> list[dict]:
+    """Every object under `prefix` (the ListObjectsV2 entries, following pagination)."""
+    params = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    paginator = client.get_paginator("list_objects_v2")
+    return [item for page in paginator.paginate(**params) for item in page.get("Contents", [])]
+
+def list_keys(client, bucket: str, prefix: str, start_after: str = "") -> list[str]:
+    """Every key under `prefix`, sorted."""
+    return sorted(item["Key"] for item in list_objects(client, bucket, prefix, start_after))
+
+
+def delete_keys(client, bucket: str, keys: list[str]):
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + DELETE_BATCH_SIZE]], "Quiet": True}
+        )
+
+# Expire objects by age (an S3 lifecycle rule on the prefix works too):
+def delete_older_than(client, bucket: str, prefix: str, max_age: float) -> int:
+    """
+    Delete every object under `prefix` last modified more than `max_age`
+    seconds ago.
+
+    Returns:
+        int: Number of objects deleted
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    expired = [item["Key"] for item in list_objects(client, bucket, prefix) if item["LastModified"] < cutoff]
+    delete_keys(client, bucket, expired)
+    return len(expired)
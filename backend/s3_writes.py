@@ -0,0 +1,101 @@
+import os
+import time
+import random
+import botocore
+
+# Retry budget for conditional writes that lose a race:
+CONDITIONAL_WRITE_ATTEMPTS = int(os.getenv("CONDITIONAL_WRITE_ATTEMPTS", "8"))
+CONDITIONAL_WRITE_BASE_DELAY = float(os.getenv("CONDITIONAL_WRITE_BASE_DELAY", "0.05"))
+CONDITIONAL_WRITE_MAX_DELAY = float(os.getenv("CONDITIONAL_WRITE_MAX_DELAY", "2.0"))
+
+# S3 error codes meaning "someone else wrote first":
+PRECONDITION_ERRORS = {"PreconditionFailed", "ConditionalRequestConflict", "412", "409"}
+
+
+class ConditionalWriteConflict(Exception):
+    """Raised when a conditional update keeps losing races after every retry."""
+
+
+def is_precondition_failure(error: Exception) -> bool:
+    return (
+        isinstance(error, botocore.exceptions.ClientError)
+        and error.response.get("Error", {}).get("Code") in PRECONDITION_ERRORS
+    )
+
+
+# Full-jitter exponential backoff:
+def backoff_delay(attempt: int, base: float = CONDITIONAL_WRITE_BASE_DELAY,
+                  cap: float = CONDITIONAL_WRITE_MAX_DELAY) -> float:
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# Create an object only if the key is free:
+def put_if_absent(client, bucket: str, key: str, body, **put_kwargs) -> bool:
+    """
+    PUT with If-None-Match: * so an existing object is never overwritten.
+
+    Returns:
+        bool: True if the object was created, False if the key already existed
+    """
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch="*", **put_kwargs)
+        return True
+    except botocore.exceptions.ClientError as error:
+        if is_precondition_failure(error):
+            return False
+        raise
+
+
+# Put an object only if it still has the ETag we read (None means "must not exist"):
+def put_if_match(client, bucket: str, key: str, body, etag: str | None, **put_kwargs) -> bool:
+    """
+    Conditional PUT against a previously read ETag.
+
+    Returns:
+        bool: True if written, False if the object changed since it was read
+    """
+    if etag is None:
+        return put_if_absent(client, bucket, key, body, **put_kwargs)
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=body, IfMatch=etag, **put_kwargs)
+        return True
+    except botocore.exceptions.ClientError as error:
+        if is_precondition_failure(error):
+            return False
+        raise
+
+
+# Read-modify-write with optimistic concurrency:
+def update_object(client, bucket: str, key: str, mutate, attempts: int = CONDITIONAL_WRITE_ATTEMPTS,
+                  **put_kwargs):
+    """
+    Apply `mutate` to an object and write it back only if nobody else wrote in between.
+
+    On a lost race the object is re-read and `mutate` re-applied after a
+    jittered backoff, so concurrent writers never clobber each other.
+
+    Args:
+        mutate (callable): Takes the current body (bytes, or None if the object
+                           is missing) and returns the new body, or None to skip
+        attempts (int): Maximum read-modify-write attempts
+
+    Returns:
+        The body that was written, or None if `mutate` skipped the write
+    """
+    for attempt in range(attempts):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key)
+            current, etag = response["Body"].read(), response["ETag"]
+        except client.exceptions.NoSuchKey:
+            current, etag = None, None
+
+        body = mutate(current)
+        if body is None:
+            return None
+
+        if put_if_match(client, bucket, key, body, etag, **put_kwargs):
+            return body
+
+        time.sleep(backoff_delay(attempt))
+
+    raise ConditionalWriteConflict(f"Gave up updating s3://{bucket}/{key} after {attempts} attempts")
@@ -0,0 +1,54 @@
+import threading
+
+from deadlines import DeadlineExceeded
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result, or the same exception.
+    Nothing is remembered once the call finishes (that is the cache's job).
+    Waiters give up after `timeout` seconds (the caller's remaining budget).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, func, timeout: float | None = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(None if timeout is None else max(timeout, 0)):
+                raise DeadlineExceeded(f"Gave up waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,193 @@
+import os
+import time
+import smtplib
+import threading
+from contextlib import contextmanager
+
+from deadlines import call_timeout, DeadlineExceeded, SMTP_TIMEOUT
+
+# Authenticated sessions kept open per worker:
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+# Idle sessions are checked with NOOP before reuse once idle this long (seconds):
+SMTP_HEALTH_CHECK_AFTER = float(os.getenv("SMTP_HEALTH_CHECK_AFTER", "30"))
+# ...and closed instead once idle this long (servers drop idle clients anyway):
+SMTP_MAX_IDLE = float(os.getenv("SMTP_MAX_IDLE", "240"))
+# Start a fresh session after this many messages (providers cap per-session sends):
+SMTP_MAX_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MAX_MESSAGES_PER_SESSION", "100"))
+
+# Errors that mean the session is gone and a new one should be tried:
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, OSError)
+# Replies that won't get better with retries (checked first: SMTPException is an OSError):
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+class _Session:
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+
+class SMTPPool:
+    """
+    A small pool of logged-in SMTP sessions.
+
+    Sessions are reused across orders and health-checked with NOOP when they
+    have been idle a while; a session that fails is dropped and the send is
+    retried once on a fresh connection. With `use_tls=False` and no
+    password it talks plain SMTP, e.g. to a local stand-in started with
+    `python -m aiosmtpd -n -l localhost:8025`.
+    """
+
+    def __init__(self, host: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = True, size: int = SMTP_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.stats = {"connects": 0, "reuses": 0, "health_check_failures": 0, "reconnects": 0, "messages": 0}
+
+    def _connect(self) -> _Session:
+        server = smtplib.SMTP(self.host, self.port, timeout=call_timeout(SMTP_TIMEOUT))
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.stats["connects"] += 1
+        return _Session(server)
+
+    @staticmethod
+    def _close(session: _Session):
+        try:
+            session.server.quit()
+        except Exception:
+            session.server.close()
+
+    def _healthy(self, session: _Session) -> bool:
+        try:
+            return session.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _checkout(self) -> _Session:
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                return self._connect()
+
+            idle = time.monotonic() - session.last_used
+            if idle > SMTP_MAX_IDLE or session.sent >= SMTP_MAX_MESSAGES_PER_SESSION:
+                self._close(session)
+                continue
+            if idle > SMTP_HEALTH_CHECK_AFTER and not self._healthy(session):
+                self.stats["health_check_failures"] += 1
+                session.server.close()
+                continue
+
+            self.stats["reuses"] += 1
+            # Bound this use by the caller's remaining budget:
+            if session.server.sock is not None:
+                session.server.sock.settimeout(call_timeout(SMTP_TIMEOUT))
+            return session
+
+    @contextmanager
+    def session(self):
+        """Borrow a logged-in session; it goes back to the pool unless the block fails."""
+        if not self._slots.acquire(timeout=call_timeout(SMTP_TIMEOUT)):
+            raise DeadlineExceeded("Timed out waiting for an SMTP session")
+        try:
+            session = self._checkout()
+            try:
+                yield session
+            except Exception:
+                session.server.close()
+                raise
+            session.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(session)
+        finally:
+            self._slots.release()
+
+    def send_messages(self, messages: list, on_result=None) -> int:
+        """
+        Send every message over one session, reconnecting once if the
+        session drops part-way (messages already accepted aren't resent).
+
+        With `on_result(index, error)` each message's outcome is reported as
+        soon as it is known (`error` is None once accepted), and a message
+        the server refuses outright is reported and skipped instead of
+        aborting the rest.
+
+        Returns:
+            int: Number of messages accepted
+        """
+        sent = 0
+        index = 0
+        with self.session() as session:
+            reconnected = False
+            while index < len(messages):
+                try:
+                    session.server.send_message(messages[index])
+                except PERMANENT_ERRORS as error:
+                    if on_result is None:
+                        raise
+                    on_result(index, error)
+                    index += 1
+                    continue
+                except _CONNECTION_ERRORS:
+                    if reconnected:
+                        raise
+                    reconnected = True
+                    self.stats["reconnects"] += 1
+                    session.server.close()
+                    fresh = self._connect()
+                    session.server, session.sent = fresh.server, 0
+                    continue
+                session.sent += 1
+                self.stats["messages"] += 1
+                sent += 1
+                if on_result is not None:
+                    on_result(index, None)
+                index += 1
+        return sent
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._close(session)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Built on first use, so settings loaded by dotenv after import are picked up:
+def get_smtp_pool() -> SMTPPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            sender_email = os.getenv("SENDER_EMAIL")
+            _pool = SMTPPool(
+                host=os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+                port=int(os.getenv("SMTP_PORT", "587")),
+                username=os.getenv("SMTP_USERNAME", sender_email),
+                password=os.getenv("SENDER_PASSWORD"),
+                use_tls=os.getenv("SMTP_USE_TLS", "1") == "1"
+            )
+        return _pool
+
+def close_smtp_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,186 @@
+import os
+import math
+import time
+import struct
+import hashlib
+import threading
+import unicodedata
+
+from log_store import LogIndex
+
+# Bloom filter sizing for the S3 snapshot:
+TEAM_NAME_BLOOM_CAPACITY = int(os.getenv("TEAM_NAME_BLOOM_CAPACITY", "100000"))
+TEAM_NAME_BLOOM_ERROR_RATE = float(os.getenv("TEAM_NAME_BLOOM_ERROR_RATE", "0.001"))
+TEAM_NAME_INDEX_MAX_STALENESS = float(os.getenv("TEAM_NAME_INDEX_MAX_STALENESS", "10"))
+# A cold worker only trusts "free" from a snapshot saved within this many seconds;
+# names created elsewhere since then are missing from it:
+TEAM_NAME_SNAPSHOT_MAX_AGE = float(os.getenv("TEAM_NAME_SNAPSHOT_MAX_AGE", str(TEAM_NAME_INDEX_MAX_STALENESS)))
+
+# Normalise a team name for comparisons ("  The LIONS! " == "the lions"):
+def normalize_team_name(name: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    characters = [
+        char if char.isalnum() else " "
+        for char in decomposed.casefold()
+        if not unicodedata.combining(char)
+    ]
+    return " ".join("".join(characters).split())
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set: no false negatives, tunable false positives.
+
+    Serialised as: b"TBF1" | bit count (u64) | hash count (u32) | item count (u64) | bits
+    """
+
+    MAGIC = b"TBF1"
+    HEADER = struct.Struct(">4sQIQ")
+
+    def __init__(self, size_bits: int, hash_count: int, bits: bytearray | None = None, count: int = 0):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size_bits + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = TEAM_NAME_BLOOM_ERROR_RATE) -> "BloomFilter":
+        capacity = max(capacity, 1)
+        size_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        hash_count = max(1, round(size_bits / capacity * math.log(2)))
+        return cls(size_bits, hash_count)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size_bits
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_bytes(self) -> bytes:
+        return self.HEADER.pack(self.MAGIC, self.size_bits, self.hash_count, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        magic, size_bits, hash_count, count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a Tribelet bloom filter snapshot")
+        return cls(size_bits, hash_count, bytearray(data[cls.HEADER.size:]), count)
+
+
+class TeamNameIndex(LogIndex):
+    """
+    Team-name availability index over TEAM_LOG.
+
+    A warm worker answers from a set of normalised names. A cold worker answers
+    "free" straight from the Bloom snapshot (no false negatives) while the
+    snapshot is younger than `snapshot_max_age`, and otherwise loads the log.
+    """
+
+    def __init__(self, log, client, bucket: str, snapshot_key: str,
+                 max_staleness: float = TEAM_NAME_INDEX_MAX_STALENESS,
+                 snapshot_max_age: float = TEAM_NAME_SNAPSHOT_MAX_AGE):
+        super().__init__(log, max_staleness)
+        self.client = client
+        self.bucket = bucket
+        self.snapshot_key = snapshot_key
+        self.snapshot_max_age = snapshot_max_age
+        self.names = None
+        self.bloom = None
+        self._bloom_saved_at = 0.0
+        self._full_load = False
+
+    def reset(self):
+        # The next add_rows builds a new set and swaps it in whole, so
+        # lookups never see a half-loaded one:
+        with self._lock:
+            self._full_load = True
+
+    def add_rows(self, rows):
+        keys = {normalize_team_name(row.get("team_name", "")) for row in rows} - {""}
+        with self._lock:
+            if self._full_load or self.names is None:
+                self.names = keys
+                self._full_load = False
+            else:
+                self.names.update(keys)
+            if self.bloom is not None:
+                for key in keys:
+                    self.bloom.add(key)
+
+    def add(self, name: str):
+        key = normalize_team_name(name)
+        if not key:
+            return
+        with self._lock:
+            if self.names is not None:
+                self.names.add(key)
+            if self.bloom is not None:
+                self.bloom.add(key)
+
+    def exists(self, name: str) -> bool:
+        key = normalize_team_name(name)
+        with self._lock:
+            if (self.names is None and self.bloom is not None and key not in self.bloom
+                    and time.time() - self._bloom_saved_at < self.snapshot_max_age):
+                self.stats["misses"] += 1
+                return False
+
+        self.refresh()
+        with self._lock:
+            found = key in self.names
+            self.stats["hits" if found else "misses"] += 1
+        return found
+
+    # --- Snapshot ---
+
+    def load_snapshot(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.snapshot_key)
+            bloom = BloomFilter.from_bytes(response["Body"].read())
+        except self.client.exceptions.NoSuchKey:
+            return
+        with self._lock:
+            self.bloom = bloom
+            self._bloom_saved_at = response["LastModified"].timestamp()
+
+    def save_snapshot(self):
+        """Rebuild the Bloom filter from the warm name set and upload it."""
+        if self.names is None:
+            return
+        with self._lock:
+            names = list(self.names)
+            saved_at = time.time()
+        bloom = BloomFilter.for_capacity(max(TEAM_NAME_BLOOM_CAPACITY, 2 * len(names)))
+        for key in names:
+            bloom.add(key)
+
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.snapshot_key,
+            Body=bloom.to_bytes(),
+            ContentType="application/octet-stream"
+        )
+        with self._lock:
+            self.bloom = bloom
+            self._bloom_saved_at = saved_at
+
+    def warm(self):
+        """Load the snapshot now and the full name set in the background."""
+        self.load_snapshot()
+
+        def load():
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                print(f"Team name index warm-up failed: {e}")
+
+        threading.Thread(target=load, name="team-name-index-warm", daemon=True).start()
@@ -19,7 +19,7 @@ const Create = () => {
   const [customName, setCustomName] = useState("");
   const [summary, setSummary] = useState("");
   const [logoOptions, setLogoOptions] = useState([]);
-  const [selectedLogo, setSelectedLogo] = useState("");
+  const [selectedLogo, setSelectedLogo] = useState(null); // { logo_id, preview_url }
 
   const teamName = customName || selectedName || "TEAM NAME";
   const progressPercentage = ((step - 1) / 5) * 100;
@@ -94,7 +94,7 @@ const Create = () => {
             onBack={() => setStep(5)}
             teamName={teamName}
             summary={summary}
-            logoUrl={selectedLogo}
+            logoId={selectedLogo?.logo_id}
           />
         );        
       default:
@@ -112,7 +112,7 @@ const Create = () => {
           }`}>
             {selectedLogo ? (
               <img
-                src={`data:image/png;base64,${selectedLogo}`}
+                src={selectedLogo.preview_url}
                 alt="Logo"
                 className="w-32 h-32 object-contain rounded-xl border-2 border-white shadow mb-4"
               />
@@ -66,7 +66,7 @@ const MyTeams = () => {
               <h3 className="text-lg font-bold text-white mb-2">{team.team_name}</h3>
               <p className="text-gray-300 text-sm mb-2">{team.summary}</p>
               {team.logo_url && (
-                <img src={team.logo_url} alt="Logo" className="h-24 w-24 object-contain mt-2" />
+                <img src={team.logo_variants?.thumbnail || team.logo_url} alt="Logo" className="h-24 w-24 object-contain mt-2" />
               )}
               <p className="text-xs text-gray-500 mt-2">Team ID: {team.team_id}</p>
             </div>
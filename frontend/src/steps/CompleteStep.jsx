@@ -3,7 +3,7 @@ import { useNavigate } from "react-router-dom";
 
 const apiUrl = process.env.REACT_APP_API_URL;
 
-const CompleteStep = ({ onBack, teamName, summary, logoUrl }) => {
+const CompleteStep = ({ onBack, teamName, summary, logoId }) => {
   const navigate = useNavigate();
   const [saving, setSaving] = useState(false);
   const [success, setSuccess] = useState(false);
@@ -19,7 +19,7 @@ const CompleteStep = ({ onBack, teamName, summary, logoUrl }) => {
     const payload = {
       team_name: teamName,
       summary,
-      logo_url: logoUrl,
+      logo_id: logoId,
       username,
       email,
       password,
@@ -3,6 +3,41 @@ import React, { useState, useEffect } from "react";
 
 const apiUrl = process.env.REACT_APP_API_URL;
 
+// How often to poll a background logo job (ms):
+const POLL_INTERVAL = 2000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Submit a logo job, then poll until its logos are ready (or the timeout passes):
+const runLogoJob = async (body, timeoutMs) => {
+  const submit = await fetch(`${apiUrl}/logo-jobs`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body)
+  });
+  if (!submit.ok) {
+    throw new Error(`HTTP error! status: ${submit.status}`);
+  }
+  const job = await submit.json();
+
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    await sleep(POLL_INTERVAL);
+    const res = await fetch(`${apiUrl}/logo-jobs/${job.job_id}/result`);
+    if (res.status === 202) continue;
+    if (!res.ok) {
+      throw new Error(`HTTP error! status: ${res.status}`);
+    }
+    return res.json();
+  }
+
+  // Give up, and free the worker for someone else:
+  fetch(`${apiUrl}/logo-jobs/${job.job_id}`, { method: "DELETE" }).catch(() => {});
+  const timeout = new Error("Logo job timed out");
+  timeout.name = "AbortError";
+  throw timeout;
+};
+
 const LogoStep = ({
   prompt,
   teamName,
@@ -88,29 +123,13 @@ const LogoStep = ({
     setLogoOptions([]); // Clear previous options
     
     try {
-      // Set a long timeout for GPT-4o logo generation (5 minutes)
-      const controller = new AbortController();
-      const timeoutId = setTimeout(() => controller.abort(), 300000); // 5 minutes
-      
-      const res = await fetch(`${apiUrl}/generate-logo`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ 
-          prompt, 
-          team_name: teamName,
-          count: 3 
-        }),
-        signal: controller.signal
-      });
-      
-      clearTimeout(timeoutId);
-      
-      if (!res.ok) {
-        throw new Error(`HTTP error! status: ${res.status}`);
-      }
-      
-      const data = await res.json();
-      setLogoOptions(data.logo_images || []);
+      // Generation runs as a background job; give up after 5 minutes
+      const data = await runLogoJob({
+        prompt,
+        team_name: teamName,
+        count: 3
+      }, 300000);
+      setLogoOptions(data.logos || []);
       
     } catch (err) {
       if (err.name === 'AbortError') {
@@ -131,26 +150,14 @@ const LogoStep = ({
     setLogoOptions(updatedOptions);
 
     try {
-      // Set timeout for single logo regeneration (2 minutes)
-      const controller = new AbortController();
-      const timeoutId = setTimeout(() => controller.abort(), 120000); // 2 minutes
-      
-      const res = await fetch(`${apiUrl}/generate-logo`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ 
-          prompt, 
-          team_name: teamName, 
-          count: 1 
-        }),
-        signal: controller.signal
-      });
-      
-      clearTimeout(timeoutId);
-      
-      const data = await res.json();
-      if (data.logo_images && data.logo_images.length > 0) {
-        updatedOptions[index] = data.logo_images[0];
+      // Single logo regeneration, as a background job (2 minute limit)
+      const data = await runLogoJob({
+        prompt,
+        team_name: teamName,
+        count: 1
+      }, 120000);
+      if (data.logos && data.logos.length > 0) {
+        updatedOptions[index] = data.logos[0];
         setLogoOptions(updatedOptions);
       }
     } catch (err) {
@@ -203,9 +210,9 @@ const LogoStep = ({
           </p>
           
           <div className="grid grid-cols-1 sm:grid-cols-3 gap-4 mb-4">
-            {logoOptions.map((b64, index) => (
+            {logoOptions.map((logo, index) => (
               <div key={index} className="relative group">
-                {b64 === "loading" ? (
+                {logo === "loading" ? (
                   <div className="aspect-square bg-gray-200 rounded-xl flex flex-col items-center justify-center animate-pulse">
                     <div className="animate-spin rounded-full h-8 w-8 border-b-2 border-[#A461F9] mb-2"></div>
                     <span className="text-gray-500 text-sm">Regenerating...</span>
@@ -213,11 +220,11 @@ const LogoStep = ({
                 ) : (
                   <>
                     <img
-                      src={`data:image/png;base64,${b64}`}
+                      src={logo.preview_url}
                       alt={`Logo ${index + 1}`}
-                      onClick={() => setSelectedLogo(b64)}
+                      onClick={() => setSelectedLogo(logo)}
                       className={`cursor-pointer w-full aspect-square object-contain rounded-xl border-4 shadow-md transition-all ${
-                        selectedLogo === b64 
+                        selectedLogo?.logo_id === logo.logo_id 
                           ? "border-[#A461F9] scale-105 shadow-lg" 
                           : "border-transparent hover:border-gray-300 hover:scale-102"
                       }`}
@@ -233,7 +240,7 @@ const LogoStep = ({
                     </button>
                     
                     {/* Selection indicator */}
-                    {selectedLogo === b64 && (
+                    {selectedLogo?.logo_id === logo.logo_id && (
                       <div className="absolute top-2 left-2 bg-[#A461F9] text-white rounded-full w-8 h-8 flex items-center justify-center text-sm shadow-md">
                         ✓
                       </div>